@@ -0,0 +1,114 @@
+"""
+Compares DOCX text extraction with python-docx (the previous implementation, body paragraphs only)
+against the streaming extractor in extraction_service, on synthetic CVs of growing size that mix
+paragraphs, tables and text boxes. Reports time, peak Python memory and how much text each finds.
+
+Run from the project root:
+    python benchmarks/bench_docx_extraction.py [--sections 10 100 1000 5000]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark") # config refuses to import without them
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from docx import Document
+
+import extraction_service
+
+NAMESPACES = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" '
+    'xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape" '
+    'xmlns:v="urn:schemas-microsoft-com:vml"'
+)
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+
+
+def paragraph(text: str) -> str:
+    return f'<w:p><w:pPr><w:tabs><w:tab w:val="left" w:pos="720"/></w:tabs></w:pPr><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+
+
+def section(number: int) -> str:
+    """One CV section: a heading and bullets, a two-column table and a text box."""
+    bullets = "".join(paragraph(f"Led migration {number}.{i} of the billing platform, cutting latency by {i}%.") for i in range(5))
+    table = "<w:tbl>" + "".join(
+        f"<w:tr><w:tc>{paragraph(f'20{row:02d}')}</w:tc><w:tc>{paragraph(f'Senior Engineer, Company {number}-{row}')}</w:tc></w:tr>"
+        for row in range(3)
+    ) + "</w:tbl>"
+    text_box = (
+        "<w:p><w:r><mc:AlternateContent><mc:Choice Requires=\"wps\"><w:drawing><wps:txbx><w:txbxContent>"
+        f"{paragraph(f'Skills {number}: Python, SQL, Kubernetes')}"
+        "</w:txbxContent></wps:txbx></w:drawing></mc:Choice><mc:Fallback><w:pict><v:textbox><w:txbxContent>"
+        f"{paragraph(f'Skills {number}: Python, SQL, Kubernetes')}"
+        "</w:txbxContent></v:textbox></w:pict></mc:Fallback></mc:AlternateContent></w:r></w:p>"
+    )
+    return paragraph(f"Experience {number}") + bullets + table + text_box
+
+
+def make_docx(sections: int) -> bytes:
+    body = "".join(section(number) for number in range(sections))
+    document = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {NAMESPACES}><w:body>{body}</w:body></w:document>'
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("_rels/.rels", RELS)
+        archive.writestr("word/document.xml", document)
+    return out.getvalue()
+
+
+def python_docx_text(content: bytes) -> str:
+    return "".join(f"{para.text}\n" for para in Document(io.BytesIO(content)).paragraphs)
+
+
+def measure(func, content: bytes, runs: int) -> tuple[float, int, str]:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        text = func(content)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func(content)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return sum(timings) / len(timings), peak, text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'sections':>8} {'size KB':>8} {'extractor':>12} {'mean s':>8} {'peak MB':>8} {'chars':>9}")
+    for sections in args.sections:
+        content = make_docx(sections)
+        for name, func in (("python-docx", python_docx_text), ("streaming", extraction_service.extract_text_from_docx)):
+            mean, peak, text = measure(func, content, args.runs)
+            print(f"{sections:>8} {len(content) // 1024:>8} {name:>12} {mean:>8.3f} {peak / 2 ** 20:>8.1f} {len(text):>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Sends a burst of CV parse requests through gemini_service against the local Gemini stub server
+and reports how the concurrency cap, rate limit, retries and circuit breaker handled them.
+
+Run from the project root:
+    python benchmarks/bench_gemini_client.py [--requests 50] [--latency 0.3] [--failure-rate 0.3]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from gemini_stub_server import start_server
+
+
+async def run(requests: int):
+    import gemini_service
+    import metrics
+
+    first_sections = []
+
+    async def parse(number: int):
+        started = time.perf_counter()
+
+        async def on_section(section: str):
+            if not reported:
+                reported.append(section)
+                first_sections.append(time.perf_counter() - started)
+
+        reported = []
+        result = await gemini_service.parse_cv_text_with_gemini(f"CV number {number}\nSenior Engineer at Example GmbH", on_section)
+        return result is not None, time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(parse(number) for number in range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    succeeded = sum(ok for ok, _ in results)
+    print(f"{succeeded}/{requests} parsed in {elapsed:.2f}s, "
+          f"p50 {latencies[len(latencies) // 2]:.2f}s, p95 {latencies[int(len(latencies) * 0.95) - 1]:.2f}s")
+    if first_sections:
+        print(f"First section reported after {sum(first_sections) / len(first_sections):.2f}s on average (streaming)")
+    for key, value in sorted(metrics.snapshot().items()):
+        if key.startswith(("gemini_", "circuit_")):
+            print(f"  {key} = {value:g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--failure-rate", type=float, default=0.3)
+    parser.add_argument("--failure-status", type=int, default=429)
+    args = parser.parse_args()
+
+    server, state = start_server(0, args.latency, args.failure_rate, args.failure_status)
+    os.environ["GEMINI_API_ENDPOINT"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark") # config refuses to import without them
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("GEMINI_RETRY_BASE_DELAY", "0.2")
+    os.environ.setdefault("GEMINI_RETRY_MAX_DELAY", "2")
+
+    asyncio.run(run(args.requests))
+    print(f"Stub saw {state.requests} requests ({state.failures} failed), at most {state.max_in_flight} in flight")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
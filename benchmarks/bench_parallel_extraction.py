@@ -0,0 +1,91 @@
+"""
+Measures PDF text extraction time against page count and number of extraction workers,
+using synthetic text-only PDFs of 1-300 pages.
+
+Run from the project root:
+    python benchmarks/bench_parallel_extraction.py [--pages 1 10 50 100 300] [--workers 1 2 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark") # config refuses to import without them
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import config
+import extraction_service
+from cache import create_cache
+from worker_pool import WorkerPool
+
+LINES_PER_PAGE = 45
+
+
+def make_pdf(page_count: int) -> bytes:
+    """Builds a minimal valid PDF with `page_count` pages of Helvetica text."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(page_count):
+        lines = "".join(
+            f"({page + 1}.{line} Led cross-functional delivery of the billing platform, cutting latency by {line}%.) Tj T* "
+            for line in range(LINES_PER_PAGE)
+        )
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {lines}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode("latin-1")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(pdf)
+
+
+async def run(page_counts: list[int], worker_counts: list[int], runs: int):
+    config.EXTRACTION_MAX_PAGES = max(page_counts)
+    config.EXTRACTION_TIMEOUT = 600
+    # Every run extracts the same PDF; a zero-byte cache stores nothing, so each run really extracts.
+    extraction_service.text_cache = create_cache("bench_text", max_bytes=0, backend="none", ttl=None)
+    print(f"{'pages':>6} {'workers':>8} {'mean s':>8} {'pages/s':>8} {'speed-up':>9}")
+    for page_count in page_counts:
+        pdf = make_pdf(page_count)
+        baseline = None
+        for workers in worker_counts:
+            pool = WorkerPool("bench", processes=workers, max_queue=workers, job_timeout=600)
+            extraction_service.extraction_pool = pool
+            pool.start()
+            await extraction_service.extract_text(pdf, extraction_service.PDF_MIME_TYPE) # Wait for workers, warm imports
+            timings = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                result = await extraction_service.extract_text(pdf, extraction_service.PDF_MIME_TYPE)
+                timings.append(time.perf_counter() - started)
+            pool.shutdown()
+            assert result and result.text.count("\n") >= page_count * (LINES_PER_PAGE - 1)
+            mean = sum(timings) / len(timings)
+            baseline = baseline or mean
+            print(f"{page_count:>6} {workers:>8} {mean:>8.3f} {page_count / mean:>8.1f} {baseline / mean:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50, 100, 300])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.pages, args.workers, args.runs))
+
+
+if __name__ == "__main__":
+    main()
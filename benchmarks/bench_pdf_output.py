@@ -0,0 +1,38 @@
+"""
+Compares PDF size and render time of each output profile for every template.
+
+Run from the project root (needs the same .env as the bot, since config is imported):
+    python benchmarks/bench_pdf_output.py [--runs 5]
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pdf_service
+from config import TEMPLATES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Timed renders per template and profile")
+    args = parser.parse_args()
+
+    pdf_service.init_render_worker() # Same warm-up as a render worker, so timings exclude font discovery
+
+    print(f"{'template':<10} {'profile':<10} {'bytes':>10} {'mean ms':>9} {'min ms':>8}")
+    for template_key in TEMPLATES:
+        for profile in pdf_service.OUTPUT_PROFILES:
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                pdf_bytes = pdf_service._render(pdf_service.SAMPLE_CV, template_key, profile)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{template_key:<10} {profile:<10} {len(pdf_bytes):>10} {statistics.mean(timings):>9.1f} {min(timings):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
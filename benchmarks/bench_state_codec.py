@@ -0,0 +1,80 @@
+"""
+Compares the compact user-state encoding (state_codec) with pickle: bytes per session and
+encode/decode time, for sessions at different stages of the CV flows.
+
+Run from the project root:
+    python benchmarks/bench_state_codec.py [--runs 2000] [--no-orjson]
+"""
+import argparse
+import copy
+import os
+import pickle
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "benchmark") # config refuses to import without them
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import config
+import state_codec
+from gemini_stub_server import STUB_CV
+from schemas import CVData
+
+
+def sample_sessions() -> dict[str, dict]:
+    cv_data = CVData.model_validate(STUB_CV).model_dump(mode="json", exclude_unset=True)
+    long_cv = copy.deepcopy(cv_data)
+    for section in ("work_experience", "education", "projects"):
+        # Distinct entries, as after a real parse (pickle would otherwise share repeated objects)
+        long_cv[section] = [{key: f"{value} {n}" if isinstance(value, str) else copy.deepcopy(value)
+                             for key, value in item.items()}
+                            for n in range(6) for item in cv_data.get(section, [])]
+    return {
+        "new scratch": {
+            "state": config.STATE_SCRATCH_AWAIT_DATA,
+            "cv_data": {"contact_info": {}, "summary": None, "work_experience": [], "education": [], "skills": [],
+                        "projects": [], "languages": [], "certifications": [], "awards": []},
+            "current_section_index": 0,
+        },
+        "reviewing": {"state": config.STATE_REVIEWING_DATA, "cv_data": cv_data},
+        "long cv": {"state": config.STATE_SELECTING_TEMPLATE, "cv_data": long_cv},
+    }
+
+
+def timed_us(func, arg, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(arg)
+        timings.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2000, help="Timed encodes/decodes per session and codec")
+    parser.add_argument("--no-orjson", action="store_true", help="Use the json module fallback")
+    args = parser.parse_args()
+    if args.no_orjson:
+        state_codec.orjson = None
+
+    codecs = {
+        "pickle": (lambda data: pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+        "compact": (state_codec.encode_user_data, state_codec.decode_user_data),
+    }
+    print(f"JSON backend: {'orjson' if state_codec.orjson else 'json'}")
+    print(f"{'session':<12} {'codec':<8} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for name, session in sample_sessions().items():
+        for codec, (encode, decode) in codecs.items():
+            payload = encode(session)
+            assert decode(payload) == session
+            print(f"{name:<12} {codec:<8} {len(payload):>7} {timed_us(encode, session, args.runs):>10.1f} "
+                  f"{timed_us(decode, payload, args.runs):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Load test of update processing under mixed traffic: many users pressing buttons (fast handlers)
+while some upload CVs (slow handlers). Compares PTB's sequential processing with
+PerUserUpdateProcessor and reports latency percentiles of the fast updates, plus a check that
+each user's updates ran in the order they arrived.
+
+Run from the project root:
+    python benchmarks/bench_update_processor.py [--updates 1000] [--rate 50] [--slow-share 0.02]
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import SimpleUpdateProcessor
+
+from update_processor import PerUserUpdateProcessor
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, first_name="Load", is_bot=False)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=Chat(id=user_id, type=Chat.PRIVATE),
+                      from_user=user, text="tap")
+    return Update(update_id=update_id, message=message)
+
+
+async def run(processor, args) -> tuple[list[float], int]:
+    rng = random.Random(args.seed)
+    fast_latencies = []
+    last_done: dict[int, int] = {}
+    out_of_order = 0
+
+    async def handle(update_id: int, user_id: int, duration: float, arrived: float, slow: bool):
+        nonlocal out_of_order
+        await asyncio.sleep(duration)
+        if last_done.get(user_id, -1) > update_id:
+            out_of_order += 1
+        last_done[user_id] = update_id
+        if not slow:
+            fast_latencies.append(time.perf_counter() - arrived)
+
+    await processor.initialize()
+    tasks = []
+    for update_id in range(args.updates):
+        user_id = rng.randrange(args.users)
+        slow = rng.random() < args.slow_share
+        duration = args.slow_ms / 1000 if slow else rng.uniform(0.5, 1.5) * args.fast_ms / 1000
+        coroutine = handle(update_id, user_id, duration, time.perf_counter(), slow)
+        # Like Application.process_update with concurrent updates: one task per update, in arrival order
+        tasks.append(asyncio.create_task(processor.process_update(make_update(update_id, user_id), coroutine)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    await processor.shutdown()
+    return fast_latencies, out_of_order
+
+
+def percentile(values: list[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="Updates per second (Poisson arrivals)")
+    parser.add_argument("--slow-share", type=float, default=0.02, help="Share of updates with a slow handler")
+    parser.add_argument("--fast-ms", type=float, default=5, help="Mean duration of a fast handler")
+    parser.add_argument("--slow-ms", type=float, default=1500, help="Duration of a slow handler (upload, render)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    processors = {
+        "sequential": lambda: SimpleUpdateProcessor(1),
+        "per-user": lambda: PerUserUpdateProcessor(args.concurrency, args.concurrency * 8),
+    }
+    print(f"{'processor':<11} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'out of order':>13}")
+    for name, factory in processors.items():
+        started = time.perf_counter()
+        latencies, out_of_order = asyncio.run(run(factory(), args))
+        latencies_ms = [latency * 1000 for latency in latencies]
+        print(f"{name:<11} {statistics.median(latencies_ms):>9.1f} {percentile(latencies_ms, 0.9):>9.1f} "
+              f"{percentile(latencies_ms, 0.99):>9.1f} {max(latencies_ms):>9.1f} {out_of_order:>13}"
+              f"   ({time.perf_counter() - started:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Local stand-in for the Gemini REST API (generateContent and streamGenerateContent), answering every
+request with the same CV JSON after a configurable latency (streamed responses spread it over their
+chunks), and failing a configurable share of requests (e.g. with 429) to exercise the bot's rate limiting, retries and circuit breaker without touching the real API.
+
+Run from the project root, then start the bot with GEMINI_API_ENDPOINT=http://localhost:8089:
+    python benchmarks/gemini_stub_server.py [--port 8089] [--latency 0.5] [--failure-rate 0.2] [--failure-status 429]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_CV = {
+    "contact_info": {"full_name": "Alex Example", "email": "alex@example.com", "phone": "+1 555 0100", "address": "Berlin"},
+    "summary": "Backend engineer with eight years of experience building payment systems.",
+    "work_experience": [{
+        "job_title": "Senior Engineer", "company": "Example GmbH", "location": "Berlin",
+        "start_date": "2019-03", "end_date": "Present",
+        "description": ["Led the billing platform migration", "Cut p99 latency by 40%"],
+    }],
+    "education": [{"degree": "BSc Computer Science", "institution": "TU Example", "graduation_date": "2016"}],
+    "skills": [{"category": "Programming Languages", "skills_list": ["Python", "Go", "SQL"]}],
+}
+
+
+STREAM_CHUNKS = 8 # Chunks a streamed response is split into
+
+
+def response_chunk(text: str, final: bool) -> dict:
+    chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+    if final:
+        chunk["candidates"][0]["finishReason"] = "STOP"
+        chunk["usageMetadata"] = {"promptTokenCount": 1000, "candidatesTokenCount": 200, "totalTokenCount": 1200}
+    return chunk
+
+
+class StubState:
+    def __init__(self, latency: float, failure_rate: float, failure_status: int):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream_json(self):
+            """Sends the CV JSON as a streamed JSON array of response chunks, spread over the latency."""
+            text = json.dumps(STUB_CV)
+            size = -(-len(text) // STREAM_CHUNKS)
+            parts = [text[i:i + size] for i in range(0, len(text), size)]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers() # No Content-Length: the body ends when the connection closes
+            self.close_connection = True
+            self.wfile.write(b"[")
+            for index, part in enumerate(parts):
+                final = index == len(parts) - 1
+                self.wfile.write(json.dumps(response_chunk(part, final)).encode("utf-8") + (b"]" if final else b",\n"))
+                self.wfile.flush()
+                if not final:
+                    time.sleep(state.latency / STREAM_CHUNKS)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = self.path.split("?")[0]
+            streaming = path.endswith(":streamGenerateContent")
+            if not streaming and not path.endswith(":generateContent"):
+                self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {self.path}", "status": "NOT_FOUND"}})
+                return
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                time.sleep(state.latency / STREAM_CHUNKS if streaming else state.latency)
+                if random.random() < state.failure_rate:
+                    with state.lock:
+                        state.failures += 1
+                    self._send_json(state.failure_status, {"error": {
+                        "code": state.failure_status, "message": "Stubbed failure", "status": "RESOURCE_EXHAUSTED"}})
+                    return
+                if streaming:
+                    self._stream_json()
+                else:
+                    self._send_json(200, response_chunk(json.dumps(STUB_CV), final=True))
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    return Handler
+
+
+def start_server(port: int, latency: float, failure_rate: float, failure_status: int) -> tuple[ThreadingHTTPServer, StubState]:
+    """Starts the stub in a background thread (port 0 picks a free port); returns the server and its counters."""
+    state = StubState(latency, failure_rate, failure_status)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before each response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests that fail (0-1)")
+    parser.add_argument("--failure-status", type=int, default=429)
+    args = parser.parse_args()
+    server, state = start_server(args.port, args.latency, args.failure_rate, args.failure_status)
+    print(f"Gemini stub listening on http://127.0.0.1:{server.server_address[1]} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print(f"{state.requests} requests, {state.failures} failed, at most {state.max_in_flight} in flight")
+
+
+if __name__ == "__main__":
+    main()
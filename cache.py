@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import redis.asyncio
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DISK_SWEEP_INTERVAL = 600 # Seconds between sweeps of a DiskCache directory for expired files
+
+
+class MemoryCache:
+    """In-process LRU cache of bytes values, bounded by total value size and optionally by age."""
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[bytes, Optional[float]]] = OrderedDict()
+        self._size = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            self.delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return # Would evict everything else and still not fit
+        self.delete(key)
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._entries[key] = (value, expires_at)
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+
+class DiskCache:
+    """
+    Cache tier storing one file per key in a directory; entries expire by file age. Writes sweep the
+    directory every DISK_SWEEP_INTERVAL seconds, deleting expired files (most keys are never read again)
+    and, over `max_bytes` (0 = no cap), the oldest ones. Going over the cap also triggers a sweep.
+    """
+
+    def __init__(self, directory: Path, ttl: Optional[float] = None, max_bytes: int = 0):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._size = 0 # Bytes in the directory as of the last sweep, plus writes since
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key # Keys are hex digests, safe as file names
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _set(self, key: str, value: bytes):
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(value)
+        os.replace(tmp_path, path) # Atomic, readers never see partial files
+        self._size += len(value)
+        if time.monotonic() >= self._next_sweep or (self.max_bytes and self._size > self.max_bytes):
+            self._sweep()
+
+    def _sweep(self):
+        """Deletes expired files, then the oldest until under max_bytes. Runs in a helper thread."""
+        if not self._sweep_lock.acquire(blocking=False):
+            return # Another write is already sweeping
+        try:
+            self._next_sweep = time.monotonic() + DISK_SWEEP_INTERVAL
+            now = time.time()
+            files = []
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    try:
+                        if not entry.is_file():
+                            continue # E.g. another cache's subdirectory
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            removed = 0
+            size = sum(file_size for _, file_size, _ in files)
+            for mtime, file_size, path in sorted(files):
+                # Oldest first; leftover .tmp files of crashed writes expire like entries.
+                if not (self.ttl and now - mtime > self.ttl) and not (self.max_bytes and size > self.max_bytes):
+                    break
+                Path(path).unlink(missing_ok=True)
+                size -= file_size
+                removed += 1
+            self._size = size
+            if removed:
+                metrics.inc("disk_cache_evictions_total", removed, cache=self.directory.name)
+                logger.debug(f"Disk cache {self.directory}: removed {removed} file(s), {size} bytes left")
+        except OSError as e:
+            logger.warning(f"Sweeping disk cache {self.directory} failed: {e}")
+        finally:
+            self._sweep_lock.release()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes):
+        await asyncio.to_thread(self._set, key, value)
+
+
+class RedisCache:
+    """Cache tier backed by Redis; entries expire through Redis TTLs."""
+
+    def __init__(self, client, prefix: str, ttl: Optional[float] = None):
+        self.client = client # A redis.asyncio.Redis created with decode_responses=False
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(f"{self.prefix}:{key}")
+
+    async def set(self, key: str, value: bytes):
+        await self.client.set(f"{self.prefix}:{key}", value, ex=int(self.ttl) if self.ttl else None)
+
+
+class TieredCache:
+    """
+    Memory LRU in front of an optional shared tier (DiskCache or RedisCache).
+    Errors from the shared tier are logged and treated as misses, so a broken
+    backend only costs performance.
+    """
+
+    def __init__(self, name: str, memory: MemoryCache, backend=None):
+        self.name = name
+        self.memory = memory
+        self.backend = backend
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is None and self.backend is not None:
+            try:
+                value = await self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"Cache '{self.name}' backend read failed: {e}")
+            if value is not None:
+                self.memory.set(key, value)
+        metrics.inc("cache_requests_total", cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    async def set(self, key: str, value: bytes):
+        self.memory.set(key, value)
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(key, value)
+        except Exception as e:
+            logger.warning(f"Cache '{self.name}' backend write failed: {e}")
+
+
+def create_cache(name: str, max_bytes: int, backend: str, ttl: Optional[float], directory: Optional[Path] = None,
+                 disk_max_bytes: int = 0) -> TieredCache:
+    """Builds a TieredCache from config values; `backend` is 'none', 'disk' or 'redis'."""
+    shared = None
+    if backend == "disk":
+        shared = DiskCache(directory or Path("cache") / name, ttl, disk_max_bytes)
+    elif backend == "redis":
+        client = redis.asyncio.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB)
+        shared = RedisCache(client, f"cvbuilder:{name}", ttl)
+    elif backend != "none":
+        logger.warning(f"Unknown cache backend '{backend}' for cache '{name}', using memory only.")
+    return TieredCache(name, MemoryCache(max_bytes, ttl), shared)
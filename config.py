@@ -8,6 +8,108 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
+# With Redis reachable, each user's state is its own key, written only when it changed.
+PERSISTENCE_KEY_PREFIX = os.getenv("PERSISTENCE_KEY_PREFIX", "cvbuilder:persistence")
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", 60)) # Seconds between writes of changed states
+
+# In production templates are treated as immutable: no reload checks at runtime.
+ENVIRONMENT = os.getenv("ENVIRONMENT", "development").lower()
+PRODUCTION = ENVIRONMENT == "production"
+
+# PDF rendering runs in a pool of worker processes so WeasyPrint never blocks the event loop.
+# Set PDF_RENDER_WORKERS=0 to render in threads of the bot process instead.
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", 2))
+PDF_RENDER_MAX_QUEUE = int(os.getenv("PDF_RENDER_MAX_QUEUE", 20)) # Jobs allowed to wait for a free worker
+PDF_RENDER_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", 60)) # Seconds before a render is killed
+# Render workers are replaced after this many jobs or once their memory exceeds the RSS cap (0 disables).
+PDF_RENDER_MAX_JOBS_PER_WORKER = int(os.getenv("PDF_RENDER_MAX_JOBS_PER_WORKER", 500))
+PDF_RENDER_MAX_RSS_MB = int(os.getenv("PDF_RENDER_MAX_RSS_MB", 512))
+
+# Text extraction from uploads runs in its own worker pool, with limits against huge or malicious files.
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", 2))
+EXTRACTION_MAX_QUEUE = int(os.getenv("EXTRACTION_MAX_QUEUE", 20))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", 30)) # Seconds per document
+EXTRACTION_MAX_PAGES = int(os.getenv("EXTRACTION_MAX_PAGES", 30))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+# Extracted text (by Telegram file_unique_id / content hash) and parsed CVs (by normalised text hash)
+# are cached so repeated uploads skip download, extraction and the Gemini call.
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MAX_BYTES", 16 * 1024 * 1024)) # Per cache
+UPLOAD_CACHE_BACKEND = os.getenv("UPLOAD_CACHE_BACKEND", "none").lower() # "none", "disk" or "redis"
+UPLOAD_CACHE_TTL = float(os.getenv("UPLOAD_CACHE_TTL", 24 * 3600))
+UPLOAD_CACHE_DISK_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_DISK_MAX_BYTES", 256 * 1024 * 1024)) # Per cache, 0 = no cap
+# PDFs with at least this many pages are split across extraction workers (needs EXTRACTION_WORKERS > 1).
+PARALLEL_EXTRACTION_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACTION_MIN_PAGES", 8))
+
+# Updates of different users are processed concurrently; each user's updates stay in order.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32)) # Updates running at once, 1 = sequential
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", 256)) # Updates accepted, running or waiting
+
+# Outgoing Bot API connections: pool shared by concurrent handlers, idle connections kept alive.
+BOT_API_POOL_SIZE = int(os.getenv("BOT_API_POOL_SIZE", 256)) # PTB's own default; keep it at least UPDATE_CONCURRENCY
+BOT_API_KEEPALIVE = float(os.getenv("BOT_API_KEEPALIVE", 60)) # Seconds an idle connection is kept open
+BOT_API_POOL_TIMEOUT = float(os.getenv("BOT_API_POOL_TIMEOUT", 5)) # Seconds to wait for a free connection
+
+# Webhook mode instead of polling when WEBHOOK_URL (public base URL, e.g. https://bot.example.com) is set.
+# The server listens on WEBHOOK_LISTEN:WEBHOOK_PORT, usually behind a TLS-terminating reverse proxy.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN") # Random per start if unset; must be the same on all replicas
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)) # Parallel deliveries Telegram may open (1-100)
+
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", 300)) # Seconds between metric log lines, 0 disables
+
+# "compact" strips metadata and recompresses/downsamples embedded raster images (150 dpi, JPEG quality 75);
+# "standard" is WeasyPrint's default output.
+PDF_OUTPUT_PROFILE = os.getenv("PDF_OUTPUT_PROFILE", "compact").lower()
+
+# Persistent Jinja bytecode cache (empty disables it) and optional expected digest of all template files,
+# as logged at startup; the bot refuses to start if TEMPLATE_DIGEST is set and the templates differ.
+TEMPLATE_BYTECODE_CACHE_DIR = os.getenv("TEMPLATE_BYTECODE_CACHE_DIR", "cache/jinja")
+TEMPLATE_DIGEST = os.getenv("TEMPLATE_DIGEST")
+
+# Rendered PDFs are cached by CV content + template. The memory tier is always on;
+# PDF_CACHE_BACKEND adds a shared tier: "none", "disk" (PDF_CACHE_DIR) or "redis".
+PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+PDF_CACHE_BACKEND = os.getenv("PDF_CACHE_BACKEND", "none").lower()
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "cache/pdf")
+PDF_CACHE_TTL = float(os.getenv("PDF_CACHE_TTL", 7 * 24 * 3600))
+PDF_CACHE_DISK_MAX_BYTES = int(os.getenv("PDF_CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024)) # 0 = no cap
+PDF_FILE_ID_CACHE_MAX_BYTES = int(os.getenv("PDF_FILE_ID_CACHE_MAX_BYTES", 1024 * 1024)) # Telegram file_ids of sent PDFs
+
+# Opt-in: render every template in the background as soon as the user confirms their data.
+SPECULATIVE_RENDERING = os.getenv("SPECULATIVE_RENDERING", "false").lower() in ("1", "true", "yes")
+SPECULATIVE_RENDER_BUDGET = int(os.getenv("SPECULATIVE_RENDER_BUDGET", 4)) # Max speculative renders in flight, all users
+
+# Low-resolution first-page previews of every template (needs the optional pypdfium2 package).
+TEMPLATE_PREVIEWS = os.getenv("TEMPLATE_PREVIEWS", "true").lower() in ("1", "true", "yes")
+TEMPLATE_PREVIEW_DPI = int(os.getenv("TEMPLATE_PREVIEW_DPI", 50))
+
+# Gemini calls share a concurrency cap and a request rate budget; transient errors (429/5xx/timeouts)
+# are retried with jittered exponential backoff, and after GEMINI_BREAKER_FAILURES consecutive
+# failures calls fail fast for GEMINI_BREAKER_RESET seconds.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 4))
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 60)) # 0 disables the rate limit
+GEMINI_CALL_TIMEOUT = float(os.getenv("GEMINI_CALL_TIMEOUT", 60)) # Seconds per attempt
+GEMINI_TOTAL_TIMEOUT = float(os.getenv("GEMINI_TOTAL_TIMEOUT", 120)) # Seconds per call, queueing and retries included
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 3))
+GEMINI_RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", 1))
+GEMINI_RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", 20))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", 5))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", 30))
+# Stream parse responses, validating and reporting each CV section as it arrives.
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "true").lower() in ("1", "true", "yes")
+# CVs with at least this many characters (after normalisation) are split at their section headings and
+# the sections parsed by parallel requests; 0 always parses the CV in one request.
+CHUNKED_PARSE_MIN_CHARS = int(os.getenv("CHUNKED_PARSE_MIN_CHARS", 6000))
+PAGE_SEPARATOR = "\f" # Between the pages of extracted PDF text, so repeated headers/footers can be recognised
+# Opt-in: uploaded CVs with standard headings and entry formats are parsed locally, without Gemini, when the
+# rule-based parser's confidence (0-1) reaches LOCAL_PARSE_MIN_CONFIDENCE.
+LOCAL_PARSER = os.getenv("LOCAL_PARSER", "false").lower() in ("1", "true", "yes")
+LOCAL_PARSE_MIN_CONFIDENCE = float(os.getenv("LOCAL_PARSE_MIN_CONFIDENCE", 0.9))
+# Alternative API endpoint, e.g. http://localhost:8089 for benchmarks/gemini_stub_server.py (uses the REST transport).
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("Missing environment variable: TELEGRAM_BOT_TOKEN")
@@ -32,9 +134,9 @@ CV_SECTIONS = [
 ]
 
 TEMPLATES = {
-    "modern": {"name": "Modern Minimalist", "file": "template_1.html"},
-    "classic": {"name": "Classic Professional", "file": "template_2.html"},
-    "creative": {"name": "Creative Tech", "file": "template_3.html"},
+    "modern": {"name": "Modern Minimalist", "file": "template_1.html", "css": "template_1.css"},
+    "classic": {"name": "Classic Professional", "file": "template_2.html", "css": "template_2.css"},
+    "creative": {"name": "Creative Tech", "file": "template_3.html", "css": "template_3.css"},
 }
 
 STATE_START = "START"
@@ -45,4 +147,17 @@ STATE_UPLOAD_AWAIT_FILE = "UPLOAD_AWAIT_FILE"
 STATE_UPLOAD_PARSING = "UPLOAD_PARSING"
 STATE_REVIEWING_DATA = "REVIEWING_DATA"
 STATE_SELECTING_TEMPLATE = "SELECTING_TEMPLATE"
-STATE_GENERATING_PDF = "GENERATING_PDF"
\ No newline at end of file
+STATE_GENERATING_PDF = "GENERATING_PDF"
+# Idle sessions are dropped (from memory and persistence) after a TTL that depends on their state;
+# 0 keeps them forever. The sweeper also caps resident sessions, evicting the least recently active
+# ones to Redis persistence (they are reloaded with the user's next update).
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", 300)) # Seconds between sweeps, 0 disables
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", 24 * 3600)) # States without their own TTL
+SESSION_IDLE_TTLS = {
+    STATE_SCRATCH_START: float(os.getenv("SESSION_TTL_SCRATCH", 48 * 3600)),
+    STATE_SCRATCH_AWAIT_DATA: float(os.getenv("SESSION_TTL_SCRATCH", 48 * 3600)),
+    STATE_UPLOAD_AWAIT_FILE: float(os.getenv("SESSION_TTL_UPLOAD", 3600)),
+    STATE_REVIEWING_DATA: float(os.getenv("SESSION_TTL_REVIEW", 24 * 3600)),
+    STATE_SELECTING_TEMPLATE: float(os.getenv("SESSION_TTL_REVIEW", 24 * 3600)),
+}
+SESSION_MAX_RESIDENT = int(os.getenv("SESSION_MAX_RESIDENT", 10000)) # 0 = no cap
@@ -0,0 +1,93 @@
+import math
+import re
+from collections import Counter
+from typing import Optional
+
+from config import PAGE_SEPARATOR
+
+# Heading lines per CVData section. A line counts as a heading only if, lower-cased and stripped of
+# punctuation, it equals one of these, so sentences that merely mention "experience" never split the text.
+SECTION_HEADINGS = {
+    "summary": ("summary", "professional summary", "profile", "professional profile", "personal profile",
+                "objective", "career objective", "about me", "about"),
+    "work_experience": ("experience", "work experience", "professional experience", "relevant experience",
+                        "employment", "employment history", "work history", "career history"),
+    "education": ("education", "academic background", "education and training", "academic qualifications",
+                  "qualifications"),
+    "skills": ("skills", "technical skills", "key skills", "core skills", "core competencies", "competencies",
+               "expertise", "skills and tools", "tools and technologies"),
+    "projects": ("projects", "personal projects", "selected projects", "key projects", "side projects"),
+    "languages": ("languages", "language skills"),
+    "certifications": ("certifications", "certificates", "licenses and certifications", "certifications and licenses",
+                       "courses", "courses and certifications", "training"),
+    "awards": ("awards", "honors", "honours", "awards and honors", "honors and awards", "achievements"),
+}
+HEADER = "header" # Text before the first heading: usually name and contact details
+MAX_HEADING_LENGTH = 40
+HEADER_FOOTER_LINES = 2 # Lines at the top and bottom of each page checked for repeated headers/footers
+
+_HEADING_INDEX = {heading: section for section, headings in SECTION_HEADINGS.items() for heading in headings}
+
+
+def heading_section(line: str) -> Optional[str]:
+    """Returns the CVData section a heading line introduces, or None if the line is not a known heading."""
+    if len(line) > MAX_HEADING_LENGTH:
+        return None
+    key = re.sub(r"[^a-z ]+", " ", line.lower().replace("&", " and "))
+    return _HEADING_INDEX.get(" ".join(key.split()))
+
+
+def segment_cv_text(cv_text: str) -> dict[str, str]:
+    """
+    Splits CV text into sections at recognised heading lines, in order of first appearance.
+    Text before the first heading is returned under HEADER; a section whose heading appears
+    more than once gets all its parts, and unrecognised headings stay in the preceding section.
+    """
+    segments: dict[str, list[str]] = {}
+    current = HEADER
+    for line in cv_text.splitlines():
+        section = heading_section(line.strip())
+        if section:
+            current = section
+            segments.setdefault(current, [])
+            continue
+        if line.strip():
+            segments.setdefault(current, []).append(line)
+    return {section: "\n".join(lines) for section, lines in segments.items() if lines}
+
+
+def _line_key(line: str) -> str:
+    """Header/footer identity of a line: case and numbers (page numbers, dates) ignored."""
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def normalize_cv_text(cv_text: str) -> str:
+    """
+    Collapses whitespace within lines, drops blank-line runs and, for multi-page PDFs, keeps only the
+    first occurrence of header/footer lines repeated at the top or bottom of most pages.
+    """
+    pages = []
+    for page in cv_text.split(PAGE_SEPARATOR):
+        lines = [" ".join(line.split()) for line in page.splitlines()]
+        pages.append([line for line in lines if line])
+
+    repeated = set()
+    if len(pages) > 1:
+        counts = Counter()
+        for lines in pages:
+            counts.update({_line_key(line) for line in lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]})
+        min_pages = max(2, math.ceil(len(pages) / 2))
+        repeated = {key for key, count in counts.items() if count >= min_pages}
+
+    seen = set()
+    kept = []
+    for lines in pages:
+        for index, line in enumerate(lines):
+            if index < HEADER_FOOTER_LINES or index >= len(lines) - HEADER_FOOTER_LINES:
+                key = _line_key(line)
+                if key in repeated:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+            kept.append(line)
+    return "\n".join(kept)
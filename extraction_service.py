@@ -0,0 +1,395 @@
+import logging
+import asyncio
+import hashlib
+import io
+import math
+import time
+import zipfile
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Iterator, Optional, Union
+from xml.etree import ElementTree
+from PyPDF2 import PdfReader
+
+import config
+import metrics
+from cache import create_cache
+from worker_pool import WorkerPool, WorkerJobTimeout, WorkerPoolError
+
+logger = logging.getLogger(__name__)
+
+PDF_MIME_TYPE = "application/pdf"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Subtrees without readable text: tab stop definitions in paragraph properties and legacy VML copies of drawings
+_DOCX_SKIPPED = {_W + "pPr", "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"}
+_DOCX_INLINE_TEXT = {_W + "tab": "\t", _W + "br": "\n", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
+
+
+class ExtractionLimitError(Exception):
+    """Raised when a document exceeds the configured page, size or time limits. The message is shown to the user."""
+
+
+@dataclass
+class ExtractionResult:
+    text: str = ""
+    page_timings: list[float] = field(default_factory=list) # Seconds spent on each page (one entry for DOCX)
+    limit_error: Optional[str] = None # Set instead of raising, exception types don't survive the worker pipe
+    page_count: int = 0
+    split: bool = False # PDF is large enough for parallel extraction; nothing was extracted yet
+
+
+class _MemoryViewReader(io.RawIOBase):
+    """Read-only seekable file over a memoryview, so parsers can read shared memory without copying it."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+
+class SharedUpload(io.RawIOBase):
+    """
+    Write-once upload buffer in a shared memory segment. Downloads are written straight into it
+    and extraction workers map it by name, so an upload exists exactly once in memory.
+    The creator must close() it, which also frees the segment.
+    """
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.capacity = max(1, capacity)
+        self.size = 0
+        self._shm = shared_memory.SharedMemory(create=True, size=self.capacity)
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        end = self.size + len(data)
+        if end > self.capacity:
+            raise ValueError(f"Upload is larger than the announced {self.capacity} bytes")
+        self._shm.buf[self.size:end] = data
+        self.size = end
+        return len(data)
+
+    def view(self) -> memoryview:
+        """Memoryview of the written bytes; release it (or use it in a with block) before close()."""
+        return self._shm.buf[:self.size]
+
+    def close(self):
+        if not self.closed:
+            self._shm.close()
+            self._shm.unlink()
+        super().close()
+
+    @classmethod
+    def from_bytes(cls, file_content: bytes) -> "SharedUpload":
+        upload = cls(len(file_content))
+        upload.write(file_content)
+        return upload
+
+
+def _open_stream(file_content: Union[bytes, memoryview]) -> io.BufferedIOBase:
+    if isinstance(file_content, memoryview):
+        return io.BufferedReader(_MemoryViewReader(file_content))
+    return io.BytesIO(file_content)
+
+
+def iter_pdf_pages(file_content: Union[bytes, memoryview], max_pages: Optional[int] = None, deadline: Optional[float] = None,
+                   start: int = 0, stop: Optional[int] = None) -> Iterator[str]:
+    """
+    Yields the text of each PDF page in order (optionally only pages start..stop-1),
+    enforcing a page limit and a time.monotonic() deadline.
+    """
+    reader = PdfReader(_open_stream(file_content))
+    page_count = len(reader.pages)
+    if max_pages and page_count > max_pages:
+        raise ExtractionLimitError(f"The PDF has {page_count} pages, the limit is {max_pages}")
+    for page_number in range(start, page_count if stop is None else min(stop, page_count)):
+        if deadline and time.monotonic() > deadline:
+            raise ExtractionLimitError("The document took too long to process")
+        yield reader.pages[page_number].extract_text() or ""
+
+def iter_docx_paragraphs(file_content: Union[bytes, memoryview], deadline: Optional[float] = None) -> Iterator[str]:
+    """
+    Yields the text of each paragraph of word/document.xml in document order, including table
+    cells and text boxes, enforcing a time.monotonic() deadline. The XML is iterparsed straight
+    from the zip and every top-level block is dropped once read, so memory stays flat.
+    Text boxes are yielded before the paragraph anchoring them; legacy VML copies of drawings
+    (mc:Fallback) are skipped so their text isn't duplicated.
+    """
+    with zipfile.ZipFile(_open_stream(file_content)) as archive, archive.open("word/document.xml") as xml:
+        body = None
+        depth = 0
+        skip_depth = 0
+        paragraphs: list[list[str]] = [] # Text parts of the open (possibly nested) paragraphs
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                depth += 1
+                if tag in _DOCX_SKIPPED:
+                    skip_depth += 1
+                elif tag == _W + "body":
+                    body = element
+                elif tag == _W + "p" and not skip_depth:
+                    paragraphs.append([])
+                continue
+
+            depth -= 1
+            if tag in _DOCX_SKIPPED:
+                skip_depth -= 1
+            elif skip_depth or not paragraphs:
+                pass
+            elif tag == _W + "t":
+                paragraphs[-1].append(element.text or "")
+            elif tag in _DOCX_INLINE_TEXT:
+                paragraphs[-1].append(_DOCX_INLINE_TEXT[tag])
+            elif tag == _W + "p":
+                if deadline and time.monotonic() > deadline:
+                    raise ExtractionLimitError("The document took too long to process")
+                yield "".join(paragraphs.pop())
+            if depth == 2 and body is not None: # End of a paragraph/table directly in the body
+                body.clear()
+
+def extract_text_from_pdf(file_content: Union[bytes, memoryview], max_pages: Optional[int] = None, deadline: Optional[float] = None) -> str:
+    """Extracts text from PDF file content, pages separated by config.PAGE_SEPARATOR."""
+    try:
+        return config.PAGE_SEPARATOR.join(iter_pdf_pages(file_content, max_pages, deadline))
+    except ExtractionLimitError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading PDF: {e}", exc_info=True)
+        return ""
+
+def extract_text_from_docx(file_content: Union[bytes, memoryview], deadline: Optional[float] = None) -> str:
+    """Extracts text from DOCX file content."""
+    try:
+        return "".join(f"{paragraph}\n" for paragraph in iter_docx_paragraphs(file_content, deadline))
+    except ExtractionLimitError:
+        raise
+    except Exception as e:
+        logger.error(f"Error reading DOCX: {e}", exc_info=True)
+        return ""
+
+
+@contextmanager
+def _attach_shared(shm_name: str, size: int) -> Iterator[memoryview]:
+    """Maps an upload placed in shared memory by the bot process, without copying it."""
+    shm = shared_memory.SharedMemory(name=shm_name) # Workers share the bot's resource tracker; the bot unlinks it
+    view = shm.buf[:size]
+    try:
+        yield view
+    finally:
+        view.release()
+        shm.close()
+
+
+def _extract_pages(file_content: memoryview, max_pages: Optional[int], deadline: float,
+                   start: int = 0, stop: Optional[int] = None) -> ExtractionResult:
+    result = ExtractionResult()
+    pages = []
+    page_iter = iter_pdf_pages(file_content, max_pages, deadline, start, stop)
+    while True:
+        started = time.perf_counter()
+        page_text = next(page_iter, None)
+        if page_text is None:
+            break
+        result.page_timings.append(time.perf_counter() - started)
+        pages.append(page_text)
+    del page_iter # Drops the reader, which holds a reference to the shared memory
+    result.text = config.PAGE_SEPARATOR.join(pages)
+    return result
+
+
+def run_extraction(shm_name: str, size: int, mime_type: str, max_pages: int, time_limit: float,
+                   split_threshold: int = 0) -> ExtractionResult:
+    """
+    Extracts text with limits and per-page timings. Runs inside an extraction worker process.
+    PDFs with at least `split_threshold` pages (if non-zero) are not extracted; the result only
+    carries the page count and `split=True` so the caller can fan the pages out over workers.
+    """
+    deadline = time.monotonic() + time_limit
+    result = ExtractionResult()
+    try:
+        with _attach_shared(shm_name, size) as file_content:
+            if mime_type == PDF_MIME_TYPE:
+                if split_threshold:
+                    reader = PdfReader(_open_stream(file_content))
+                    page_count = len(reader.pages)
+                    del reader
+                    if max_pages and page_count > max_pages:
+                        raise ExtractionLimitError(f"The PDF has {page_count} pages, the limit is {max_pages}")
+                    if page_count >= split_threshold:
+                        return ExtractionResult(page_count=page_count, split=True)
+                result = _extract_pages(file_content, max_pages, deadline)
+            elif mime_type == DOCX_MIME_TYPE:
+                started = time.perf_counter()
+                result.text = extract_text_from_docx(file_content, deadline)
+                result.page_timings.append(time.perf_counter() - started)
+    except ExtractionLimitError as e:
+        result.limit_error = str(e)
+    except Exception as e:
+        logger.error(f"Error reading {mime_type} document: {e}", exc_info=True)
+        result.text = ""
+    return result
+
+
+def run_page_range_extraction(shm_name: str, size: int, start: int, stop: int, time_limit: float) -> ExtractionResult:
+    """Extracts PDF pages start..stop-1. Runs inside an extraction worker process."""
+    deadline = time.monotonic() + time_limit
+    try:
+        with _attach_shared(shm_name, size) as file_content:
+            return _extract_pages(file_content, None, deadline, start, stop)
+    except ExtractionLimitError as e:
+        return ExtractionResult(limit_error=str(e))
+
+
+extraction_pool = WorkerPool(
+    "extract",
+    processes=config.EXTRACTION_WORKERS,
+    max_queue=config.EXTRACTION_MAX_QUEUE,
+    job_timeout=config.EXTRACTION_TIMEOUT + 5, # Hard stop if the cooperative deadline is missed (e.g. one huge page)
+)
+
+
+# Extracted text by content hash, and by Telegram file_unique_id so repeat uploads skip the download too.
+text_cache = create_cache(
+    "extracted_text",
+    max_bytes=config.UPLOAD_CACHE_MAX_BYTES,
+    backend=config.UPLOAD_CACHE_BACKEND,
+    ttl=config.UPLOAD_CACHE_TTL,
+    disk_max_bytes=config.UPLOAD_CACHE_DISK_MAX_BYTES,
+)
+
+def _file_cache_key(file_unique_id: str) -> str:
+    return hashlib.sha256(f"telegram-file:{file_unique_id}".encode("utf-8")).hexdigest()
+
+async def get_text_for_file(file_unique_id: str) -> Optional[str]:
+    """Returns the text previously extracted from the Telegram file with this file_unique_id, if cached."""
+    text = await text_cache.get(_file_cache_key(file_unique_id))
+    return text.decode("utf-8") if text is not None else None
+
+async def remember_text_for_file(file_unique_id: str, text: str):
+    await text_cache.set(_file_cache_key(file_unique_id), text.encode("utf-8"))
+
+
+async def _extract_in_parallel(shm_name: str, size: int, page_count: int, time_limit: float) -> ExtractionResult:
+    """
+    Splits a PDF's pages into contiguous ranges, one per worker (as far as the pool has room),
+    and joins their text in page order. If a range fails the others are cancelled, and all of
+    them have stopped before this returns, so the caller can safely release the shared memory.
+    """
+    chunk_count = max(1, min(extraction_pool.processes, extraction_pool.free_slots,
+                             math.ceil(page_count / config.PARALLEL_EXTRACTION_MIN_PAGES)))
+    chunk_size = math.ceil(page_count / chunk_count)
+    ranges = [(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+    logger.info(f"Extracting {page_count} PDF pages in {len(ranges)} parallel range(s)")
+
+    jobs = [asyncio.ensure_future(extraction_pool.submit(run_page_range_extraction, shm_name, size, start, stop, time_limit))
+            for start, stop in ranges]
+    try:
+        await asyncio.wait(jobs, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for job in jobs:
+            job.cancel() # No-op for finished jobs
+        await asyncio.wait(jobs)
+    for job in jobs:
+        if not job.cancelled() and job.exception() is not None:
+            raise job.exception()
+    parts = [job.result() for job in jobs]
+    result = ExtractionResult(page_count=page_count)
+    for part in parts:
+        if part.limit_error:
+            result.limit_error = part.limit_error
+        result.page_timings.extend(part.page_timings)
+    result.text = config.PAGE_SEPARATOR.join(part.text for part in parts)
+    return result
+
+
+async def extract_text(upload: Union[SharedUpload, bytes], mime_type: str) -> Optional[ExtractionResult]:
+    """
+    Extracts the text of an uploaded PDF/DOCX in the extraction worker pool.
+    Workers map the upload's shared memory instead of receiving a copy; plain bytes are placed in
+    shared memory first. PDFs with at least PARALLEL_EXTRACTION_MIN_PAGES pages are extracted by
+    several workers in parallel.
+    Raises ExtractionLimitError if the document is too large, has too many pages or takes too long;
+    returns None if extraction failed for another reason.
+    """
+    owned = not isinstance(upload, SharedUpload)
+    if owned:
+        if len(upload) > config.MAX_UPLOAD_BYTES: # Check before copying it anywhere
+            raise ExtractionLimitError(f"The file is larger than {config.MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+        if not upload:
+            return None
+        upload = SharedUpload.from_bytes(upload)
+    try:
+        return await _extract_shared(upload, mime_type)
+    finally:
+        if owned:
+            upload.close()
+
+
+async def _extract_shared(upload: SharedUpload, mime_type: str) -> Optional[ExtractionResult]:
+    if upload.size > config.MAX_UPLOAD_BYTES:
+        raise ExtractionLimitError(f"The file is larger than {config.MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    if not upload.size:
+        return None
+
+    with upload.view() as file_content:
+        content_key = hashlib.sha256(file_content).hexdigest()
+    cached_text = await text_cache.get(content_key)
+    if cached_text is not None:
+        return ExtractionResult(text=cached_text.decode("utf-8"))
+
+    split_threshold = config.PARALLEL_EXTRACTION_MIN_PAGES if extraction_pool.processes > 1 else 0
+    started = time.monotonic()
+    try:
+        result: ExtractionResult = await extraction_pool.submit(
+            run_extraction, upload.name, upload.size, mime_type,
+            config.EXTRACTION_MAX_PAGES, config.EXTRACTION_TIMEOUT, split_threshold
+        )
+        if result.split:
+            remaining = max(0.0, config.EXTRACTION_TIMEOUT - (time.monotonic() - started))
+            result = await _extract_in_parallel(upload.name, upload.size, result.page_count, remaining)
+    except WorkerJobTimeout:
+        raise ExtractionLimitError("The document took too long to process")
+    except WorkerPoolError as e:
+        logger.error(f"Text extraction failed: {e}")
+        return None
+
+    if result.limit_error:
+        raise ExtractionLimitError(result.limit_error)
+
+    for seconds in result.page_timings:
+        metrics.observe("extraction_page_seconds", seconds, mime_type=mime_type)
+    if result.page_timings:
+        logger.info(f"Extracted {len(result.page_timings)} page(s) in {sum(result.page_timings):.2f}s "
+                    f"(slowest {max(result.page_timings):.2f}s)")
+    if result.text and not result.text.isspace():
+        await text_cache.set(content_key, result.text.encode("utf-8"))
+    return result
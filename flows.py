@@ -1,14 +1,20 @@
 import logging
-from telegram import Update, InputFile
+from telegram import Update, InputFile, InputMediaPhoto, Message
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, TelegramError
 import io
-from typing import Optional, List, Dict, Any 
+import asyncio
+import hashlib
+from typing import Optional, List
 import config
 import utils
 import gemini_service
+import extraction_service
+import local_parser
 import pdf_service
-from schemas import CVData, ContactInfo, WorkExperienceItem, EducationItem, SkillItem, ProjectItem, LanguageItem, CertificationItem, AwardItem
+import speculation
+from schemas import CVData
 logger = logging.getLogger(__name__)
 
 
@@ -125,176 +131,23 @@ async def handle_scratch_input(update: Update, context: ContextTypes.DEFAULT_TYP
                 await update.effective_message.reply_text("Sorry, there was an error processing that input. Please check the format and try again, or type 'DONE'.")
         return True 
 
-    def parse_work_experience(text: str) -> Optional[Dict[str, Any]]:
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        if not lines: return None
-        item = WorkExperienceItem().model_dump() # Get default dict
-        try:
-            # "Title at Company (Start - End)"
-            first_line_parts = lines[0].split(' at ')
-            item['job_title'] = first_line_parts[0].strip()
-            company_date_parts = first_line_parts[1].split('(')
-            item['company'] = company_date_parts[0].strip()
-            date_str = company_date_parts[1].replace(')', '').strip()
-            if ' - ' in date_str:
-                start_date, end_date = [d.strip() for d in date_str.split(' - ', 1)]
-                item['start_date'] = start_date
-                item['end_date'] = end_date
-            else:
-                 item['start_date'] = date_str # Or handle error
-
-            desc_lines = []
-            loc_line = 1 # Check line 2 for location first
-            if len(lines) > 1 and not lines[loc_line].startswith('-'):
-                 item['location'] = lines[loc_line]
-                 desc_lines = lines[loc_line+1:]
-            else:
-                 desc_lines = lines[1:] 
-
-            item['description'] = [line.lstrip('- ') for line in desc_lines if line.startswith('-')]
-
-            return item
-        except IndexError: # Handle cases where split fails
-             logger.warning(f"IndexError parsing work experience: {text}")
-             return None
-        except Exception as e:
-            logger.error(f"Generic error parsing work experience: {e} for text {text}")
-            return None # Or re-raise specific errors
-
-    def parse_education(text: str) -> Optional[Dict[str, Any]]:
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        if not lines: return None
-        item = EducationItem().model_dump()
-        try:
-            first_line_parts = lines[0].split(' from ')
-            item['degree'] = first_line_parts[0].strip()
-            inst_date_parts = first_line_parts[1].split('(')
-            item['institution'] = inst_date_parts[0].strip()
-            item['graduation_date'] = inst_date_parts[1].replace(')', '').strip()
-
-            detail_lines = []
-            loc_line = 1
-            if len(lines) > 1 and '(' not in lines[loc_line] and 'from' not in lines[loc_line]: # Heuristic for location vs details
-                 item['location'] = lines[loc_line]
-                 detail_lines = lines[loc_line+1:]
-            else:
-                 detail_lines = lines[1:]
-
-            item['details'] = "\n".join(detail_lines).strip() if detail_lines else None
-            return item
-        except IndexError:
-            logger.warning(f"IndexError parsing education: {text}")
-            return None
-        except Exception as e:
-            logger.error(f"Generic error parsing education: {e} for text {text}")
-            return None
-
-    def parse_project(text: str) -> Optional[Dict[str, Any]]:
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        if not lines: return None
-        item = ProjectItem().model_dump()
-        data_map = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                data_map[key.strip().lower()] = value.strip()
-
-        item['project_name'] = data_map.get('project name')
-        item['description'] = data_map.get('description')
-        item['technologies'] = [t.strip() for t in data_map.get('technologies', '').split(',') if t.strip()]
-        item['project_url'] = data_map.get('url')
-        item['duration'] = data_map.get('duration')
-
-        if not item['project_name']: # Require at least a name
-            return None
-        return item
-
-    def parse_language(text: str) -> Optional[Dict[str, Any]]:
-         parts = [p.strip() for p in text.split('-', 1)]
-         if len(parts) == 2:
-             item = LanguageItem().model_dump()
-             item['language'] = parts[0]
-             item['proficiency'] = parts[1]
-             return item
-         return None
-
-    def parse_certification(text: str) -> Optional[Dict[str, Any]]:
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        if not lines: return None
-        item = CertificationItem().model_dump()
-        data_map = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                data_map[key.strip().lower().replace('issuing org', 'issuing_organization')] = value.strip() # Normalize key
-
-        item['name'] = data_map.get('certification name')
-        item['issuing_organization'] = data_map.get('issuing_organization')
-        item['issue_date'] = data_map.get('date')
-        item['credential_id'] = data_map.get('id')
-        item['credential_url'] = data_map.get('url')
-
-        if not item['name']: # Require name
-            return None
-        return item
-
-    def parse_award(text: str) -> Optional[Dict[str, Any]]:
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
-        if not lines: return None
-        item = AwardItem().model_dump()
-        data_map = {}
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                data_map[key.strip().lower()] = value.strip()
-
-        item['name'] = data_map.get('award name')
-        item['organization'] = data_map.get('organization')
-        item['date'] = data_map.get('date')
-        item['description'] = data_map.get('description')
-
-        if not item['name']: # Require name
-            return None
-        return item
-
     # --- Main Input Handling Logic ---
     should_pause = False
     if section_key == "work_experience":
-        should_pause = await process_multi_entry('work_experience', parse_work_experience)
+        should_pause = await process_multi_entry('work_experience', local_parser.parse_work_experience)
     elif section_key == "education":
-        should_pause = await process_multi_entry('education', parse_education)
+        should_pause = await process_multi_entry('education', local_parser.parse_education)
     elif section_key == "projects":
-        should_pause = await process_multi_entry('projects', parse_project)
+        should_pause = await process_multi_entry('projects', local_parser.parse_project)
     elif section_key == "languages":
-        should_pause = await process_multi_entry('languages', parse_language)
+        should_pause = await process_multi_entry('languages', local_parser.parse_language)
     elif section_key == "certifications":
-        should_pause = await process_multi_entry('certifications', parse_certification)
+        should_pause = await process_multi_entry('certifications', local_parser.parse_certification)
     elif section_key == "awards":
-        should_pause = await process_multi_entry('awards', parse_award)
+        should_pause = await process_multi_entry('awards', local_parser.parse_award)
 
     elif section_key == "skills":
-        lines = [line.strip() for line in user_input.split('\n') if line.strip()]
-        parsed_skills = []
-        for line in lines:
-             if ':' in line:
-                  category, skills_part = line.split(':', 1)
-                  skills_list = [s.strip() for s in skills_part.split(',') if s.strip()]
-                  if skills_list:
-                       parsed_skills.append(SkillItem(category=category.strip(), skills_list=skills_list).model_dump())
-             else:
-                  skills_list = [s.strip() for s in line.split(',') if s.strip()]
-                  if skills_list:
-                       # Check if a 'General' category already exists to append
-                       found_general = False
-                       for item in parsed_skills:
-                            if item.get('category', '').lower() == 'general':
-                                 item.setdefault('skills_list', []).extend(skills_list)
-                                 item['skills_list'] = list(set(item['skills_list'])) # Avoid duplicates
-                                 found_general = True
-                                 break
-                       if not found_general:
-                            parsed_skills.append(SkillItem(category="General", skills_list=skills_list).model_dump())
-
+        parsed_skills = local_parser.parse_skills(user_input)
         if parsed_skills:
              cv_data['skills'] = parsed_skills # Replace previous simple list/structure
              context.user_data['current_section_index'] += 1
@@ -329,6 +182,22 @@ async def request_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📄 Please upload your CV as a PDF or DOCX file."
     )
 
+def _parse_progress_reporter(message: Message):
+    """Returns a callback that lists the CV sections recognised so far by editing `message`."""
+    found: List[str] = []
+
+    async def on_section(section_key: str):
+        if section_key in found: # Repeated when a request is retried
+            return
+        found.append(section_key)
+        lines = "\n".join(f"✅ {key.replace('_', ' ').title()}" for key in found)
+        try:
+            await message.edit_text(f"🔎 Reading your CV...\n{lines}")
+        except TelegramError as e:
+            logger.debug(f"Could not update parse progress: {e}")
+
+    return on_section
+
 async def handle_cv_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles the uploaded CV file, extracts text, and calls Gemini."""
     if not update.message.document:
@@ -336,30 +205,43 @@ async def handle_cv_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     doc = update.message.document
-    if doc.mime_type not in ["application/pdf", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
+    if doc.mime_type not in [extraction_service.PDF_MIME_TYPE, extraction_service.DOCX_MIME_TYPE]:
         await update.effective_message.reply_text("Sorry, I can only process PDF or DOCX files. Please upload a valid file.")
         return
 
-    await update.effective_message.reply_text("⏳ Got it! Processing your CV... (This might take a moment)")
+    if doc.file_size and doc.file_size > config.MAX_UPLOAD_BYTES:
+        await update.effective_message.reply_text(f"😥 That file is too large. Please upload a CV smaller than {config.MAX_UPLOAD_BYTES // (1024 * 1024)} MB.")
+        return
+
+    progress_message = await update.effective_message.reply_text("⏳ Got it! Processing your CV... (This might take a moment)")
     context.user_data['state'] = config.STATE_UPLOAD_PARSING
 
     try:
-        file = await context.bot.get_file(doc.file_id)
-        file_bytes = await file.download_as_bytearray()
-        file_content = bytes(file_bytes) 
-
-        text = ""
-        if doc.mime_type == "application/pdf":
-            text = utils.extract_text_from_pdf(file_content)
-        elif doc.mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            text = utils.extract_text_from_docx(file_content)
+        text = await extraction_service.get_text_for_file(doc.file_unique_id)
+        if text is None:
+            upload = await utils.download_document(context.bot, doc)
+            try:
+                extraction = await extraction_service.extract_text(upload, doc.mime_type)
+            except extraction_service.ExtractionLimitError as e:
+                await update.effective_message.reply_text(f"😥 {e}. Please upload a shorter CV, or try the 'Create from Scratch' option.")
+                await utils.cleanup_user_data(context)
+                return
+            finally:
+                upload.close()
+            text = extraction.text if extraction else ""
+            if text and not text.isspace():
+                await extraction_service.remember_text_for_file(doc.file_unique_id, text)
 
         if not text or text.isspace():
             await update.effective_message.reply_text("😥 I couldn't extract any text from your document. Please check the file or try a different format.")
             await utils.cleanup_user_data(context)
             return
 
-        parsed_data: Optional[CVData] = await gemini_service.parse_cv_text_with_gemini(text)
+        parsed_data: Optional[CVData] = local_parser.try_parse_cv_text(text)
+        if parsed_data is None:
+            parsed_data = await gemini_service.parse_cv_text_with_gemini(
+                text, on_section=_parse_progress_reporter(progress_message)
+            )
 
         if parsed_data:
             context.user_data['cv_data'] = parsed_data.model_dump(mode='json', exclude_unset=True) # Store as dict
@@ -421,6 +303,11 @@ async def handle_review_confirmation(update: Update, context: ContextTypes.DEFAU
     await query.answer() 
 
     if confirmed:
+        if config.SPECULATIVE_RENDERING:
+            try:
+                speculation.start(update.effective_user.id, CVData.model_validate(context.user_data.get('cv_data', {})))
+            except Exception as e:
+                logger.warning(f"Could not start speculative renders: {e}")
         await query.edit_message_text("Great! Now, let's choose a template.")
         await ask_template_selection(update, context) 
     else:
@@ -430,7 +317,7 @@ async def handle_review_confirmation(update: Update, context: ContextTypes.DEFAU
 async def ask_template_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends the template selection keyboard."""
     context.user_data['state'] = config.STATE_SELECTING_TEMPLATE
-    keyboard = utils.create_template_selection_keyboard()
+    keyboard = utils.create_template_selection_keyboard(with_preview=pdf_service.previews_available())
     if update.callback_query:
          await update.callback_query.edit_message_text(
              "🎨 Choose a template style for your CV:",
@@ -442,6 +329,78 @@ async def ask_template_selection(update: Update, context: ContextTypes.DEFAULT_T
               reply_markup=keyboard
          )
 
+async def handle_template_preview(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sends a low-resolution first-page preview of the user's CV in every template, then asks again."""
+    query = update.callback_query
+    await query.answer()
+
+    cv_data_dict = context.user_data.get('cv_data')
+    if not cv_data_dict:
+        logger.error("No CV data found during template preview.")
+        await query.edit_message_text("Something went wrong, I lost your data. Please start over with /start.")
+        await utils.cleanup_user_data(context)
+        return
+
+    await query.edit_message_text("🖼 Rendering previews of your CV... Please wait.")
+    try:
+        cv_data_model = CVData.model_validate(cv_data_dict)
+    except Exception as e:
+        logger.error(f"Data validation failed before preview: {e}", exc_info=True)
+        await query.message.reply_text("Error validating data before creating previews. Please restart.")
+        await utils.cleanup_user_data(context)
+        return
+
+    previews = await asyncio.gather(*(pdf_service.generate_preview_png(cv_data_model, key) for key in config.TEMPLATES))
+
+    media, digests = [], []
+    for idx, ((key, details), png_bytes) in enumerate(zip(config.TEMPLATES.items(), previews)):
+        caption = f"{idx+1}. {details['name']}"
+        if png_bytes is None: # Render failed or the pool is busy: show the layout with sample data instead
+            png_bytes = pdf_service.sample_thumbnails.get(key)
+            caption += " (sample data)"
+        if png_bytes is None:
+            continue
+        digest = hashlib.sha256(png_bytes).hexdigest()
+        file_id = await pdf_service.get_sent_file_id(digest)
+        media.append(InputMediaPhoto(media=file_id or png_bytes, caption=caption))
+        digests.append(None if file_id else digest)
+
+    if media:
+        try:
+            sent_messages = await query.message.reply_media_group(media=media)
+            for digest, sent_message in zip(digests, sent_messages):
+                if digest and sent_message.photo:
+                    await pdf_service.remember_sent_file_id(digest, sent_message.photo[-1].file_id)
+        except Exception as e:
+            logger.error(f"Failed to send template previews: {e}", exc_info=True)
+            media = []
+    if not media:
+        await query.message.reply_text("😥 Sorry, I couldn't create previews right now.")
+
+    await query.message.reply_text(
+        "🎨 Choose a template style for your CV:",
+        reply_markup=utils.create_template_selection_keyboard()
+    )
+
+async def send_pdf_document(message, pdf_bytes: bytes, cv_data_model: CVData):
+    """Sends the PDF as a reply, reusing the Telegram file_id if identical bytes were uploaded before."""
+    caption = "✅ Here is your generated CV! ✨"
+    pdf_digest = hashlib.sha256(pdf_bytes).hexdigest()
+
+    file_id = await pdf_service.get_sent_file_id(pdf_digest)
+    if file_id:
+        try:
+            await message.reply_document(document=file_id, caption=caption)
+            return
+        except BadRequest as e:
+            logger.warning(f"Stored file_id for PDF {pdf_digest[:12]} was rejected, uploading again: {e}")
+
+    full_name = cv_data_model.contact_info.full_name if cv_data_model.contact_info else None
+    pdf_file = InputFile(io.BytesIO(pdf_bytes), filename=f"CVBuilder_{full_name or 'cv'}.pdf")
+    sent_message = await message.reply_document(document=pdf_file, caption=caption)
+    if sent_message.document:
+        await pdf_service.remember_sent_file_id(pdf_digest, sent_message.document.file_id)
+
 async def handle_template_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, template_key: str):
     """Generates the PDF using the selected template."""
     query = update.callback_query
@@ -471,17 +430,13 @@ async def handle_template_selection(update: Update, context: ContextTypes.DEFAUL
          await utils.cleanup_user_data(context)
          return
 
-    # Generate PDF
+    # Generate PDF (instant if a speculative render already put it in the cache)
+    await speculation.wait(update.effective_user.id, template_key)
     pdf_bytes = await pdf_service.generate_cv_pdf(cv_data_model, template_key)
 
     if pdf_bytes:
         try:
-            # Send the PDF
-            pdf_file = InputFile(io.BytesIO(pdf_bytes), filename=f"CVBuilder_{cv_data_model.contact_info.full_name or 'cv'}.pdf")
-            await query.message.reply_document(
-                document=pdf_file,
-                caption="✅ Here is your generated CV! ✨"
-            )
+            await send_pdf_document(query.message, pdf_bytes, cv_data_model)
             await query.edit_message_text("✅ PDF generated and sent!")
         except Exception as e:
              logger.error(f"Failed to send PDF document: {e}", exc_info=True)
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: rate limiting, overload and transient server/network failures.
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
+
+class GeminiError(Exception):
+    """Base error for calls made through GeminiClient."""
+
+class GeminiUnavailable(GeminiError):
+    """Raised when the call was not attempted or gave up: circuit open, no capacity in time, retries exhausted."""
+
+
+class TokenBucket:
+    """Async token bucket: allows `rate` acquisitions per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock: # Waiters are served in order
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds. Then a single trial call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def before_call(self) -> bool:
+        """
+        Raises GeminiUnavailable if the call must not be attempted now. Returns True if this call is
+        the half-open trial; only that call may then end the trial (record_failure / release_trial).
+        """
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_running):
+            metrics.inc("circuit_rejected_total", circuit=self.name)
+            raise GeminiUnavailable(f"Circuit '{self.name}' is open, failing fast")
+        if state == "half_open":
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info(f"Circuit '{self.name}' closed again")
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        metrics.set_gauge("circuit_open", 0, circuit=self.name)
+
+    def record_failure(self, trial: bool = False):
+        """`trial` is what before_call returned for the failed call."""
+        self._failures += 1
+        if trial or (self._opened_at is None and self.failure_threshold and self._failures >= self.failure_threshold):
+            logger.warning(f"Circuit '{self.name}' opened after {self._failures} consecutive failure(s), "
+                           f"failing fast for {self.reset_timeout:g}s")
+            self._opened_at = time.monotonic()
+            metrics.set_gauge("circuit_open", 1, circuit=self.name)
+        if trial:
+            self._trial_running = False
+
+    def release_trial(self):
+        """Ends a half-open trial that neither succeeded nor failed (e.g. it was cancelled). Only for the trial call."""
+        self._trial_running = False
+
+
+class GeminiClient:
+    """
+    Wraps an async Gemini call (e.g. `model.generate_content_async`) with a global concurrency cap,
+    a token-bucket rate limit, per-attempt and per-call deadlines, jittered exponential retries
+    of transient errors and a circuit breaker. Non-transient errors (invalid request, blocked
+    prompt, ...) are raised unchanged and don't count against the circuit.
+    """
+
+    def __init__(self, call: Callable[..., Awaitable[Any]], name: str = "gemini", max_concurrency: int = 4,
+                 requests_per_minute: float = 0, call_timeout: float = 60, total_timeout: float = 120,
+                 max_retries: int = 3, retry_base_delay: float = 1, retry_max_delay: float = 20,
+                 breaker_failures: int = 5, breaker_reset: float = 30):
+        self._call = call
+        self.name = name
+        self.call_timeout = call_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max(0, max_retries)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._bucket = TokenBucket(requests_per_minute / 60, max_concurrency) if requests_per_minute > 0 else None
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_reset)
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: uniform between 0 and the capped exponential delay."""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+    async def _wait_for_slot(self):
+        await self._semaphore.acquire()
+        try:
+            if self._bucket:
+                await self._bucket.acquire()
+        except BaseException: # Includes the cancellation by _attempt's deadline
+            self._semaphore.release()
+            raise
+
+    async def _attempt(self, call: Callable[..., Awaitable[Any]], deadline: float, args: tuple, kwargs: dict) -> Any:
+        try:
+            await asyncio.wait_for(self._wait_for_slot(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            metrics.inc("gemini_requests_total", client=self.name, result="no_capacity")
+            raise GeminiUnavailable(f"No Gemini capacity within {self.total_timeout:g}s")
+
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: # Nothing sent, so this says nothing about the API's health
+                metrics.inc("gemini_requests_total", client=self.name, result="deadline_exceeded")
+                raise GeminiUnavailable(f"No time left for a Gemini call within {self.total_timeout:g}s")
+            trial = self.breaker.before_call()
+            timeout = min(self.call_timeout, remaining)
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(call(*args, **kwargs), timeout)
+            except RETRYABLE_ERRORS:
+                self.breaker.record_failure(trial)
+                raise
+            except BaseException: # Cancelled, or a bad request that says nothing about the API's health
+                if trial:
+                    self.breaker.release_trial()
+                raise
+            finally:
+                metrics.observe("gemini_call_seconds", time.monotonic() - started, client=self.name)
+            self.breaker.record_success()
+            return result
+        finally:
+            self._semaphore.release()
+
+    async def generate(self, *args, **kwargs) -> Any:
+        """
+        Calls the wrapped function with the given arguments and returns its result.
+        Raises GeminiUnavailable if the circuit is open, no capacity frees up before the deadline
+        or transient errors persist through all retries; other errors propagate unchanged.
+        """
+        return await self.run(self._call, *args, **kwargs)
+
+    async def run(self, call: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Like generate(), but for another coroutine function making the request, e.g. one that
+        consumes a streamed response. The whole call is one attempt and is retried from scratch.
+        """
+        deadline = time.monotonic() + self.total_timeout
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await self._attempt(call, deadline, args, kwargs)
+            except GeminiUnavailable:
+                raise
+            except RETRYABLE_ERRORS as e:
+                metrics.inc("gemini_requests_total", client=self.name, result="transient_error")
+                delay = self._backoff(attempt)
+                if attempt == self.max_retries or time.monotonic() + delay >= deadline:
+                    raise GeminiUnavailable(f"Gemini call failed after {attempt + 1} attempt(s): {e!r}") from e
+                logger.warning(f"Transient Gemini error ({e!r}), retrying in {delay:.1f}s "
+                               f"(attempt {attempt + 1}/{self.max_retries + 1})")
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                metrics.inc("gemini_requests_total", client=self.name, result="error")
+                raise
+            metrics.inc("gemini_requests_total", client=self.name, result="ok")
+            return result
@@ -1,16 +1,29 @@
 import logging
+import asyncio
 import google.generativeai as genai
+import hashlib
 import json
-from pydantic import ValidationError
-from typing import Optional
+import time
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from typing import Any, Awaitable, Callable, Optional, Union, get_args, get_origin
 
 import config
+import cv_segmenter
+from cv_segmenter import normalize_cv_text
+import metrics
+from cache import create_cache
+from gemini_client import GeminiClient, GeminiUnavailable
+from single_flight import SingleFlight
 from schemas import CVData
 
 logger = logging.getLogger(__name__)
 
 try:
-    genai.configure(api_key=config.GEMINI_API_KEY)
+    if config.GEMINI_API_ENDPOINT:
+        genai.configure(api_key=config.GEMINI_API_KEY, transport="rest",
+                        client_options={"api_endpoint": config.GEMINI_API_ENDPOINT})
+    else:
+        genai.configure(api_key=config.GEMINI_API_KEY)
     model = genai.GenerativeModel(
         'gemini-2.5-flash-preview-04-17',
         generation_config=genai.types.GenerationConfig(
@@ -22,71 +35,387 @@ except Exception as e:
     logger.error(f"Failed to configure Gemini AI client: {e}", exc_info=True)
     model = None
 
+async def _generate_content(prompt: str):
+    if config.GEMINI_API_ENDPOINT: # The REST transport has no async client
+        return await asyncio.to_thread(model.generate_content, prompt, request_options={"timeout": config.GEMINI_CALL_TIMEOUT})
+    return await model.generate_content_async(prompt, request_options={"timeout": config.GEMINI_CALL_TIMEOUT})
+
+# All Gemini requests go through this client: concurrency cap, rate limit, retries and circuit breaker.
+gemini = GeminiClient(
+    _generate_content,
+    max_concurrency=config.GEMINI_MAX_CONCURRENCY,
+    requests_per_minute=config.GEMINI_REQUESTS_PER_MINUTE,
+    call_timeout=config.GEMINI_CALL_TIMEOUT,
+    total_timeout=config.GEMINI_TOTAL_TIMEOUT,
+    max_retries=config.GEMINI_MAX_RETRIES,
+    retry_base_delay=config.GEMINI_RETRY_BASE_DELAY,
+    retry_max_delay=config.GEMINI_RETRY_MAX_DELAY,
+    breaker_failures=config.GEMINI_BREAKER_FAILURES,
+    breaker_reset=config.GEMINI_BREAKER_RESET,
+)
+
+# Validated CVData JSON by hash of the whitespace-normalised CV text.
+parsed_cv_cache = create_cache(
+    "parsed_cv",
+    max_bytes=config.UPLOAD_CACHE_MAX_BYTES,
+    backend=config.UPLOAD_CACHE_BACKEND,
+    ttl=config.UPLOAD_CACHE_TTL,
+    disk_max_bytes=config.UPLOAD_CACHE_DISK_MAX_BYTES,
+)
+
+# Identical CV texts submitted while a parse is running (re-uploads, double submits) share that parse.
+parse_flights = SingleFlight("gemini_parse")
+
+def _parsed_cv_cache_key(normalised_text: str) -> str:
+    return hashlib.sha256(normalised_text.encode("utf-8")).hexdigest()
+
+def _schema_skeleton(annotation):
+    """Reduces a field annotation to an example shape: "string", [item] or {field: shape}."""
+    origin = get_origin(annotation)
+    if origin is Union:
+        return _schema_skeleton(next(arg for arg in get_args(annotation) if arg is not type(None)))
+    if origin is list:
+        return [_schema_skeleton(get_args(annotation)[0])]
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {name: _schema_skeleton(field.annotation) for name, field in annotation.model_fields.items()}
+    return "string"
+
+def _build_prompt_tail(sections: tuple[str, ...]) -> str:
+    """
+    Instructions and target shape for extracting `sections`. Built once per section set at import:
+    every field is optional, so the shape alone is enough and costs far fewer tokens than the full
+    JSON schema with titles, descriptions and anyOf/null branches.
+    """
+    shape = json.dumps({name: _schema_skeleton(CVData.model_fields[name].annotation) for name in sections}, separators=(",", ":"))
+    return f"""
+---
+
+Instructions:
+1. Extract these sections if present: {", ".join(sections)}.
+2. For list sections create one object per distinct item found in the text.
+3. Group skills into categories (e.g. "Programming Languages", "Software", "Databases", "Soft Skills"); if unsure use "Technical Skills" or "Other Skills".
+4. Languages: name and proficiency (Native, Fluent, Conversational, Basic). Projects: name, description, technologies, URL. Certifications: name, issuer, issue date, credential URL/ID. Awards: name, organization, date.
+5. Format dates consistently if possible (YYYY-MM or Month YYYY), otherwise keep the original. Use "Present" for current roles.
+6. Omit keys of sections or fields that are missing from the text.
+7. Output a single valid JSON object with exactly this shape ("string" = a string value, [x] = a list of x):
+{shape}
+8. Output only the raw JSON object, without markdown fences or any other text.
+
+JSON Output:
+"""
+
+_PROMPT_HEAD = "Analyze the following CV text and extract the information into a structured JSON object.\n\nCV Text:\n---\n"
+_PROMPT_TAIL = _build_prompt_tail(tuple(CVData.model_fields))
+
+# Section-chunked parsing of long CVs: which CVData sections each segment of cv_segmenter is asked for.
+_CHUNK_PROMPT_HEAD = "Analyze the following part of a CV and extract the information into a structured JSON object.\n\nCV Text:\n---\n"
+_CHUNK_SECTIONS = {section: (section,) for section in cv_segmenter.SECTION_HEADINGS}
+_CHUNK_SECTIONS[cv_segmenter.HEADER] = ("contact_info", "summary")
+_HEADER_WITHOUT_SUMMARY = ("contact_info",) # When the CV has its own summary section
+# The header chunk covers at least this many leading lines of the CV, so contact details placed just
+# after the first section (e.g. under an unrecognised "Contact" heading) are still found.
+CONTACT_CHUNK_MIN_LINES = 15
+_CHUNK_PROMPT_TAILS = {sections: _build_prompt_tail(sections) for sections in [*_CHUNK_SECTIONS.values(), _HEADER_WITHOUT_SUMMARY]}
+
 def get_parsing_prompt(cv_text: str) -> str:
-    """Creates the prompt for Gemini to parse CV text."""
-
-    schema_description = CVData.model_json_schema()
-
-    prompt = f"""
-    Analyze the following CV text and extract the information into a structured JSON object.
-
-    **CV Text:**
-    ---
-    {cv_text}
-    ---
-
-    **Instructions:**
-    1.  Extract the relevant information for the following sections if present: Contact Information (`contact_info`), Summary (`summary`), Work Experience (`work_experience`), Education (`education`), Skills (`skills`), Projects (`projects`), Languages (`languages`), Certifications (`certifications`), Awards (`awards`).
-    2.  For `work_experience`, `education`, `projects`, `languages`, `certifications`, and `awards`, create a list of objects, one for each distinct item found in the text.
-    3.  For `skills`, structure them as a list of objects: `[{{"category": "...", "skills_list": ["...", "..."]}}]`. Attempt categorization (e.g., "Programming Languages", "Software", "Databases", "Soft Skills", "Languages"). If unsure, use a general category like "Technical Skills" or "Other Skills".
-    4.  For `languages`, extract the language name and proficiency level (e.g., Native, Fluent, Conversational, Basic).
-    5.  For `projects`, include name, description, technologies used, and URL if available.
-    6.  For `certifications`, include name, issuing body, issue date, and credential URL/ID if available.
-    7.  For `awards`, include name, organization, and date.
-    8.  Format dates consistently if possible (e.g., YYYY-MM or Month YYYY), but preserve original if unclear. Use "Present" for current roles.
-    9.  For descriptions (work experience, projects), provide a list of strings or a single string where appropriate based on the schema.
-    10. If a section is clearly missing in the text, omit its key from the JSON or represent it as `null` or an empty list (`[]`) as appropriate based on the schema definition.
-    11. **Output MUST be a valid JSON object conforming strictly to this Pydantic schema:**
-        ```json
-        {schema_description}
-        ```
-    12. Do NOT include any introductory text, explanations, comments, or markdown formatting (like ```json) around the JSON output. Only output the raw, valid JSON object itself.
-
-    **JSON Output:**
+    """Creates the prompt for Gemini to parse (already normalised) CV text."""
+    return _PROMPT_HEAD + cv_text + _PROMPT_TAIL
+
+def _record_usage(response, started: float):
+    """Logs and counts the tokens a Gemini response reports."""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    prompt_tokens = usage.prompt_token_count
+    output_tokens = usage.candidates_token_count
+    metrics.inc("gemini_tokens_total", prompt_tokens, kind="prompt")
+    metrics.inc("gemini_tokens_total", output_tokens, kind="output")
+    metrics.observe("gemini_prompt_tokens", prompt_tokens)
+    logger.info(f"Gemini used {prompt_tokens} prompt + {output_tokens} output tokens in {time.monotonic() - started:.1f}s")
+
+class MalformedResponseError(ValueError):
+    """Raised when a streamed response stops looking like a valid CVData JSON object."""
+
+# Validators of the top-level CVData sections, for checking each section as soon as it has streamed in.
+_SECTION_ADAPTERS = {name: TypeAdapter(field.annotation) for name, field in CVData.model_fields.items()}
+_JSON_FENCE = "```json"
+
+class SectionStreamParser:
+    """
+    Scans a JSON object as it streams in and returns each top-level member as soon as its value is
+    complete. A leading ```json fence is tolerated; any other text before the object or invalid
+    JSON in a member raises MalformedResponseError.
     """
-    return prompt
 
-async def parse_cv_text_with_gemini(cv_text: str) -> Optional[CVData]:
-    """Uses Gemini API to parse CV text into a structured CVData object."""
-    if not model:
-        logger.error("Gemini model not initialized.")
-        return None
-    if not cv_text or cv_text.isspace():
-        logger.warning("Received empty CV text for parsing.")
-        return None
+    def __init__(self):
+        self.text = ""
+        self.finished = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start: Optional[int] = None
+
+    def _member(self, end: int) -> Optional[tuple[str, Any]]:
+        raw = self.text[self._member_start:end].strip()
+        if not raw: # Empty object
+            return None
+        try:
+            return next(iter(json.loads("{" + raw + "}").items()))
+        except (json.JSONDecodeError, StopIteration) as e:
+            raise MalformedResponseError(f"Invalid JSON member in response: {raw[:80]!r}") from e
 
-    prompt = get_parsing_prompt(cv_text)
-    logger.info("Sending request to Gemini API for CV parsing...")
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        """Adds a chunk of the response; returns the (key, value) members completed by it."""
+        self.text += chunk
+        completed = []
+        for i in range(self._pos, len(self.text)):
+            if self.finished:
+                break
+            char = self.text[i]
+            if self._member_start is None: # Before the opening brace
+                if char == "{":
+                    self._depth = 1
+                    self._member_start = i + 1
+                elif not _JSON_FENCE.startswith(self.text[:i + 1].strip().lower()):
+                    raise MalformedResponseError(f"Response does not start with a JSON object: {self.text[:80]!r}")
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.append(self._member(i))
+                    self.finished = True
+            elif char == "," and self._depth == 1:
+                completed.append(self._member(i))
+                self._member_start = i + 1
+        self._pos = len(self.text)
+        return [member for member in completed if member is not None]
 
+def _chunk_text(chunk) -> str:
     try:
-        response = await model.generate_content_async(prompt) 
+        return chunk.text
+    except ValueError: # Chunks without text parts, e.g. the final one carrying only the finish reason
+        return ""
+
+async def _stream_chunks(prompt: str):
+    request_options = {"timeout": config.GEMINI_CALL_TIMEOUT}
+    if config.GEMINI_API_ENDPOINT: # The REST transport has no async client: pull chunks in a thread
+        chunks = iter(await asyncio.to_thread(model.generate_content, prompt, stream=True, request_options=request_options))
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            yield chunk
+    else:
+        async for chunk in await model.generate_content_async(prompt, stream=True, request_options=request_options):
+            yield chunk
+
+async def _stream_content(prompt: str, report: Optional[Callable[[str], None]] = None) -> tuple[str, Any]:
+    """
+    Streams a parse response, validating each top-level section as soon as it is complete and
+    passing its name to `report`. Raises MalformedResponseError as soon as the output goes wrong.
+    Returns the full response text and the last chunk (which carries the usage metadata).
+    """
+    parser = SectionStreamParser()
+    last_chunk = None
+    async for chunk in _stream_chunks(prompt):
+        last_chunk = chunk
+        for name, value in parser.feed(_chunk_text(chunk)):
+            adapter = _SECTION_ADAPTERS.get(name)
+            if adapter is None:
+                continue
+            try:
+                adapter.validate_python(value)
+            except ValidationError as e:
+                raise MalformedResponseError(f"Section {name} does not match the schema: {e}") from e
+            if report:
+                report(name)
+    return parser.text, last_chunk
+
+def _response_json(response_text: str) -> str:
+    return response_text.strip().removeprefix("```json").removesuffix("```").strip()
+
+async def _parse_whole(prompt: str, report: Optional[Callable[[str], None]]) -> Optional[CVData]:
+    """Parses the CV with a single request (streamed with GEMINI_STREAMING)."""
+    try:
+        started = time.monotonic()
+        if config.GEMINI_STREAMING:
+            response_text, response = await gemini.run(_stream_content, prompt, report)
+        else:
+            response = await gemini.generate(prompt)
+            response_text = None
+        _record_usage(response, started)
 
         try:
-            json_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
-            parsed_data = CVData.model_validate_json(json_text)
+            if response_text is None:
+                response_text = response.text
+            parsed_data = CVData.model_validate_json(_response_json(response_text))
             logger.info("Successfully parsed and validated CV data from Gemini.")
             return parsed_data
         except json.JSONDecodeError as e:
-            logger.error(f"Gemini response was not valid JSON: {e}\nRaw response:\n{response.text}", exc_info=True)
+            logger.error(f"Gemini response was not valid JSON: {e}\nRaw response:\n{response_text}", exc_info=True)
             return None
         except ValidationError as e:
-            logger.error(f"Gemini response JSON did not match schema: {e}\nRaw response:\n{response.text}", exc_info=True)
+            logger.error(f"Gemini response JSON did not match schema: {e}\nRaw response:\n{response_text}", exc_info=True)
             return None
-        except AttributeError:
+        except (AttributeError, ValueError):
              logger.error(f"Could not access Gemini response text. Response object: {response}", exc_info=True)
              return None
 
 
+    except MalformedResponseError as e:
+        metrics.inc("gemini_stream_aborted_total")
+        logger.error(f"Aborted malformed Gemini response: {e}")
+        return None
+    except GeminiUnavailable as e:
+        logger.error(f"Gemini API unavailable: {e}")
+        return None
     except Exception as e:
         logger.error(f"Error calling Gemini API: {e}", exc_info=True)
-        return None
\ No newline at end of file
+        return None
+
+async def _parse_chunk(sections: tuple[str, ...], chunk_text: str,
+                       report: Optional[Callable[[str], None]]) -> dict[str, Any]:
+    """Extracts `sections` from one segment of the CV; returns the validated sections found."""
+    started = time.monotonic()
+    response = await gemini.generate(_CHUNK_PROMPT_HEAD + chunk_text + _CHUNK_PROMPT_TAILS[sections])
+    _record_usage(response, started)
+    data = json.loads(_response_json(response.text))
+    found = {}
+    for section in sections:
+        if data.get(section) is not None:
+            _SECTION_ADAPTERS[section].validate_python(data[section])
+            found[section] = data[section]
+            if report:
+                report(section)
+    return found
+
+async def _parse_in_sections(cv_text: str, segments: dict[str, str],
+                             report: Optional[Callable[[str], None]]) -> Optional[CVData]:
+    """
+    Parses each segment of a long CV with its own, much smaller request, all in parallel (within
+    the client's concurrency limit), and merges the sections. contact_info comes from the header
+    chunk, which must exist. Returns None if any request failed, so the caller can fall back to
+    parsing the CV in one piece.
+    """
+    chunks = []
+    for segment, chunk_text in segments.items():
+        sections = _CHUNK_SECTIONS[segment]
+        if segment == cv_segmenter.HEADER:
+            if "summary" in segments:
+                sections = _HEADER_WITHOUT_SUMMARY
+            leading_lines = cv_text.splitlines()[:max(CONTACT_CHUNK_MIN_LINES, len(chunk_text.splitlines()))]
+            chunk_text = "\n".join(leading_lines)
+        chunks.append((segment, sections, chunk_text))
+    logger.info(f"Parsing CV in {len(chunks)} section chunk(s): {', '.join(segment for segment, _, _ in chunks)}")
+
+    results = await asyncio.gather(
+        *(_parse_chunk(sections, chunk_text, report) for _, sections, chunk_text in chunks),
+        return_exceptions=True,
+    )
+    merged: dict[str, Any] = {}
+    for (segment, _, _), result in zip(chunks, results):
+        if isinstance(result, BaseException):
+            metrics.inc("gemini_chunk_failures_total", section=segment)
+            logger.warning(f"Parsing the {segment} chunk failed: {result!r}")
+            return None
+        merged.update(result)
+    try:
+        return CVData.model_validate(merged)
+    except ValidationError as e:
+        logger.error(f"Merged section results did not match schema: {e}")
+        return None
+
+async def parse_cv_text_with_gemini(cv_text: str, on_section: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[CVData]:
+    """
+    Uses Gemini API to parse CV text into a structured CVData object.
+    CVs of at least CHUNKED_PARSE_MIN_CHARS characters with recognisable section headings are
+    parsed section by section in parallel. `on_section` is awaited with the name of each top-level
+    section as soon as it has arrived and validated (possibly more than once if a request is retried),
+    from a separate task and in order; all reports are delivered before this returns. A call that
+    joins an identical parse already in flight gets no progress reports.
+    """
+    if not model:
+        logger.error("Gemini model not initialized.")
+        return None
+    if not cv_text or cv_text.isspace():
+        logger.warning("Received empty CV text for parsing.")
+        return None
+
+    normalised_text = normalize_cv_text(cv_text)
+    cache_key = _parsed_cv_cache_key(normalised_text)
+    cached_json = await parsed_cv_cache.get(cache_key)
+    if cached_json is not None:
+        logger.info("Using cached parse result for identical CV text.")
+        return CVData.model_validate_json(cached_json)
+
+    return await parse_flights.run(cache_key, _parse_uncached, normalised_text, cache_key, on_section)
+
+class _SectionReporter:
+    """
+    Passes section names to an on_section callback from a task of its own, in order, so a slow
+    callback (a Telegram message edit) never runs inside a Gemini attempt's timeout or holds its
+    concurrency slot.
+    """
+
+    def __init__(self, on_section: Callable[[str], Awaitable[None]]):
+        self._queue: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        self._task = asyncio.create_task(self._deliver(on_section))
+
+    def report(self, section: str):
+        self._queue.put_nowait(section)
+
+    async def _deliver(self, on_section: Callable[[str], Awaitable[None]]):
+        while (section := await self._queue.get()) is not None:
+            try:
+                await on_section(section)
+            except Exception as e:
+                logger.warning(f"Section progress callback failed: {e}")
+
+    async def close(self):
+        """Waits until the reports queued so far are delivered."""
+        self._queue.put_nowait(None)
+        await self._task
+
+    def cancel(self):
+        self._task.cancel()
+
+async def _parse_uncached(normalised_text: str, cache_key: str,
+                          on_section: Optional[Callable[[str], Awaitable[None]]]) -> Optional[CVData]:
+    reporter = _SectionReporter(on_section) if on_section else None
+    try:
+        parsed_data = await _parse_and_cache(normalised_text, cache_key, reporter.report if reporter else None)
+    except BaseException:
+        if reporter:
+            reporter.cancel()
+        raise
+    if reporter:
+        await reporter.close() # So no late progress edit lands after the caller shows the result
+    return parsed_data
+
+async def _parse_and_cache(normalised_text: str, cache_key: str,
+                          report: Optional[Callable[[str], None]]) -> Optional[CVData]:
+    started = time.monotonic()
+    logger.info(f"Sending request to Gemini API for CV parsing ({len(normalised_text)} chars of normalised text)...")
+    parsed_data = None
+    if config.CHUNKED_PARSE_MIN_CHARS and len(normalised_text) >= config.CHUNKED_PARSE_MIN_CHARS:
+        segments = cv_segmenter.segment_cv_text(normalised_text)
+        # Without a header segment no chunk would be asked for contact_info: parse in one piece.
+        if cv_segmenter.HEADER in segments and len(segments.keys() - {cv_segmenter.HEADER}) >= 2:
+            parsed_data = await _parse_in_sections(normalised_text, segments, report)
+            if parsed_data is None and gemini.breaker.state != "closed":
+                return None # The API is failing; a whole-CV request would fail too
+    if parsed_data is None:
+        parsed_data = await _parse_whole(get_parsing_prompt(normalised_text), report)
+
+    if parsed_data is not None:
+        metrics.observe("gemini_parse_seconds", time.monotonic() - started)
+        await parsed_cv_cache.set(cache_key, parsed_data.model_dump_json(exclude_unset=True).encode("utf-8"))
+    return parsed_data
@@ -4,6 +4,7 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
@@ -12,6 +13,7 @@ from telegram.constants import ParseMode
 import utils
 import flows
 import config
+import sessions
 
 logger = logging.getLogger(__name__)
 
@@ -104,6 +106,12 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
              logger.warning("Received review callback in unexpected state.")
 
 
+    elif callback_data == "preview_templates":
+         if user_state == config.STATE_SELECTING_TEMPLATE:
+              await flows.handle_template_preview(update, context)
+         else:
+              logger.warning("Received template preview callback in unexpected state.")
+
     elif callback_data.startswith("select_template_"):
          if user_state == config.STATE_SELECTING_TEMPLATE:
               template_key = callback_data.replace("select_template_", "")
@@ -124,4 +132,5 @@ start_handler = CommandHandler("start", start)
 help_handler = CommandHandler("help", help_command)
 message_handler = MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message)
 document_handler = MessageHandler(filters.Document.ALL, handle_document)
-callback_query_handler = CallbackQueryHandler(handle_callback_query)
\ No newline at end of file
+callback_query_handler = CallbackQueryHandler(handle_callback_query)
+activity_handler = TypeHandler(Update, sessions.track_activity) # Registered in group -1, before the others
\ No newline at end of file
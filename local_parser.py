@@ -0,0 +1,383 @@
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+import config
+import cv_segmenter
+import metrics
+from schemas import CVData, WorkExperienceItem, EducationItem, SkillItem, ProjectItem, LanguageItem, CertificationItem, AwardItem
+
+logger = logging.getLogger(__name__)
+
+# --- Item parsers for the formats the scratch flow asks for, also used on uploaded CV text ---
+
+def parse_work_experience(text: str) -> Optional[Dict[str, Any]]:
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if not lines: return None
+    item = WorkExperienceItem().model_dump() # Get default dict
+    try:
+        # "Title at Company (Start - End)"
+        first_line_parts = lines[0].split(' at ')
+        item['job_title'] = first_line_parts[0].strip()
+        company_date_parts = first_line_parts[1].split('(')
+        item['company'] = company_date_parts[0].strip()
+        date_str = company_date_parts[1].replace(')', '').strip()
+        if ' - ' in date_str:
+            start_date, end_date = [d.strip() for d in date_str.split(' - ', 1)]
+            item['start_date'] = start_date
+            item['end_date'] = end_date
+        else:
+             item['start_date'] = date_str # Or handle error
+
+        desc_lines = []
+        loc_line = 1 # Check line 2 for location first
+        if len(lines) > 1 and not lines[loc_line].startswith('-'):
+             item['location'] = lines[loc_line]
+             desc_lines = lines[loc_line+1:]
+        else:
+             desc_lines = lines[1:] 
+
+        item['description'] = [line.lstrip('- ') for line in desc_lines if line.startswith('-')]
+
+        return item
+    except IndexError: # Handle cases where split fails
+         logger.warning(f"IndexError parsing work experience: {text}")
+         return None
+    except Exception as e:
+        logger.error(f"Generic error parsing work experience: {e} for text {text}")
+        return None # Or re-raise specific errors
+
+def parse_education(text: str) -> Optional[Dict[str, Any]]:
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if not lines: return None
+    item = EducationItem().model_dump()
+    try:
+        first_line_parts = lines[0].split(' from ')
+        item['degree'] = first_line_parts[0].strip()
+        inst_date_parts = first_line_parts[1].split('(')
+        item['institution'] = inst_date_parts[0].strip()
+        item['graduation_date'] = inst_date_parts[1].replace(')', '').strip()
+
+        detail_lines = []
+        loc_line = 1
+        if len(lines) > 1 and '(' not in lines[loc_line] and 'from' not in lines[loc_line]: # Heuristic for location vs details
+             item['location'] = lines[loc_line]
+             detail_lines = lines[loc_line+1:]
+        else:
+             detail_lines = lines[1:]
+
+        item['details'] = "\n".join(detail_lines).strip() if detail_lines else None
+        return item
+    except IndexError:
+        logger.warning(f"IndexError parsing education: {text}")
+        return None
+    except Exception as e:
+        logger.error(f"Generic error parsing education: {e} for text {text}")
+        return None
+
+def parse_project(text: str) -> Optional[Dict[str, Any]]:
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if not lines: return None
+    item = ProjectItem().model_dump()
+    data_map = {}
+    for line in lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            data_map[key.strip().lower()] = value.strip()
+
+    item['project_name'] = data_map.get('project name')
+    item['description'] = data_map.get('description')
+    item['technologies'] = [t.strip() for t in data_map.get('technologies', '').split(',') if t.strip()]
+    item['project_url'] = data_map.get('url')
+    item['duration'] = data_map.get('duration')
+
+    if not item['project_name']: # Require at least a name
+        return None
+    return item
+
+def parse_language(text: str) -> Optional[Dict[str, Any]]:
+     parts = [p.strip() for p in text.split('-', 1)]
+     if len(parts) == 2:
+         item = LanguageItem().model_dump()
+         item['language'] = parts[0]
+         item['proficiency'] = parts[1]
+         return item
+     return None
+
+def parse_certification(text: str) -> Optional[Dict[str, Any]]:
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if not lines: return None
+    item = CertificationItem().model_dump()
+    data_map = {}
+    for line in lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            data_map[key.strip().lower().replace('issuing org', 'issuing_organization')] = value.strip() # Normalize key
+
+    item['name'] = data_map.get('certification name')
+    item['issuing_organization'] = data_map.get('issuing_organization')
+    item['issue_date'] = data_map.get('date')
+    item['credential_id'] = data_map.get('id')
+    item['credential_url'] = data_map.get('url')
+
+    if not item['name']: # Require name
+        return None
+    return item
+
+def parse_award(text: str) -> Optional[Dict[str, Any]]:
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    if not lines: return None
+    item = AwardItem().model_dump()
+    data_map = {}
+    for line in lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            data_map[key.strip().lower()] = value.strip()
+
+    item['name'] = data_map.get('award name')
+    item['organization'] = data_map.get('organization')
+    item['date'] = data_map.get('date')
+    item['description'] = data_map.get('description')
+
+    if not item['name']: # Require name
+        return None
+    return item
+
+def parse_skills(text: str) -> List[Dict[str, Any]]:
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    parsed_skills = []
+    for line in lines:
+         if ':' in line:
+              category, skills_part = line.split(':', 1)
+              skills_list = [s.strip() for s in skills_part.split(',') if s.strip()]
+              if skills_list:
+                   parsed_skills.append(SkillItem(category=category.strip(), skills_list=skills_list).model_dump())
+         else:
+              skills_list = [s.strip() for s in line.split(',') if s.strip()]
+              if skills_list:
+                   # Check if a 'General' category already exists to append
+                   found_general = False
+                   for item in parsed_skills:
+                        if item.get('category', '').lower() == 'general':
+                             item.setdefault('skills_list', []).extend(skills_list)
+                             item['skills_list'] = list(set(item['skills_list'])) # Avoid duplicates
+                             found_general = True
+                             break
+                   if not found_general:
+                        parsed_skills.append(SkillItem(category="General", skills_list=skills_list).model_dump())
+    return parsed_skills
+
+
+# --- Fast path for uploaded CVs: deterministic parse plus a confidence score ---
+
+_WORK_ENTRY_RE = re.compile(r"^.+ at [^(]+\([^)]*\)$")
+_EDUCATION_ENTRY_RE = re.compile(r"^.+ from [^(]+\([^)]*\)$")
+_BULLET_RE = re.compile(r"^[•▪●◦·*]\s*")
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_PHONE_RE = re.compile(r"\+?\d[\d\s().-]{6,}\d")
+_LINKEDIN_RE = re.compile(r"(?:https?://)?(?:www\.)?linkedin\.com/[^\s,|]+", re.IGNORECASE)
+_URL_RE = re.compile(r"(?:https?://|www\.)[^\s,|]+", re.IGNORECASE)
+_NAME_RE = re.compile(r"^[^\W\d_][^\W\d_'.\- ]*(?:[ '.\-]+[^\W\d_]+){1,4}\.?$")
+_HEADING_LIKE_RE = re.compile(r"^[^\W\d_][^\d,:;.!?()@/|+\-]*$")
+_HEADING_JOINERS = {"and", "&", "of", "for", "in", "the"}
+_SENTENCE_END = (".", "!", "?")
+SUMMARY_MAX_LINES = 6 # Longest first paragraph counted as a summary
+SKILL_MAX_WORDS = 4 # Longer comma-separated items are prose, not a skills list
+
+_KEYED_FIELDS = {
+    "projects": ("project name", "description", "technologies", "url", "duration"),
+    "certifications": ("certification name", "issuing org", "date", "id", "url"),
+    "awards": ("award name", "organization", "date", "description"),
+}
+_KEYED_PARSERS = {"projects": parse_project, "certifications": parse_certification, "awards": parse_award}
+
+
+def _clean_line(line: str) -> str:
+    """Bullets become "- " and en/em dashes "-", as in the scratch formats."""
+    line = line.strip().replace("–", "-").replace("—", "-")
+    return _BULLET_RE.sub("- ", line)
+
+
+def _compact(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in item.items() if value not in (None, "", [])}
+
+
+def _split_entries(lines: List[str], is_start: Callable[[str], bool]) -> tuple[List[str], List[List[str]]]:
+    """Splits lines into entries at each line matching `is_start`; returns (lines before the first entry, entries)."""
+    preamble: List[str] = []
+    entries: List[List[str]] = []
+    for line in lines:
+        if is_start(line):
+            entries.append([line])
+        elif entries:
+            entries[-1].append(line)
+        else:
+            preamble.append(line)
+    return preamble, entries
+
+
+def _looks_like_heading(line: str) -> bool:
+    """A short Title Case or upper-case line without digits or punctuation, e.g. "Publications"."""
+    words = line.split()
+    return (len(line) <= cv_segmenter.MAX_HEADING_LENGTH and len(words) <= 4 and bool(_HEADING_LIKE_RE.match(line))
+            and all(word[0].isupper() or word.lower() in _HEADING_JOINERS for word in words))
+
+
+def _before_unknown_heading(lines: List[str]) -> List[str]:
+    """
+    The lines before the first one that looks like a heading segment_cv_text didn't recognise: it folds
+    unknown sections (Publications, Volunteering, ...) into the preceding one, whose parser must not see them.
+    A location line right after a work or education entry line is not a heading.
+    """
+    for index, line in enumerate(lines):
+        after_entry = index and (_WORK_ENTRY_RE.match(lines[index - 1]) or _EDUCATION_ENTRY_RE.match(lines[index - 1]))
+        if _looks_like_heading(line) and not after_entry:
+            return lines[:index]
+    return lines
+
+
+def _is_skills_line(line: str) -> bool:
+    """`Category: Skill, Skill` or a list of at least two short comma-separated skills."""
+    category, _, listed = line.partition(":") if ":" in line else ("", "", line)
+    if category and len(category) > cv_segmenter.MAX_HEADING_LENGTH:
+        return False
+    items = [item.strip() for item in listed.split(",") if item.strip()]
+    if not items or any(len(item.split()) > SKILL_MAX_WORDS for item in items):
+        return False
+    return bool(category) or len(items) >= 2
+
+
+def _parse_header(lines: List[str]) -> tuple[Dict[str, Any], int]:
+    """Contact details from the lines before the first heading; returns (contact_info, lines used)."""
+    contact: Dict[str, Any] = {}
+    used = 0
+    for line in lines:
+        found = False
+        if (match := _EMAIL_RE.search(line)) and "email" not in contact:
+            contact["email"] = match.group()
+            found = True
+        if (match := _LINKEDIN_RE.search(line)) and "linkedin_url" not in contact:
+            url = match.group()
+            contact["linkedin_url"] = url if url.lower().startswith("http") else f"https://{url}"
+            found = True
+        for match in _URL_RE.finditer(line):
+            url = match.group()
+            if "linkedin.com" not in url.lower() and "portfolio_url" not in contact:
+                contact["portfolio_url"] = url if url.lower().startswith("http") else f"https://{url}"
+                found = True
+        if (match := _PHONE_RE.search(_EMAIL_RE.sub("", _URL_RE.sub("", line)))) and "phone" not in contact:
+            contact["phone"] = match.group().strip()
+            found = True
+        if not found and "full_name" not in contact and _NAME_RE.match(line):
+            contact["full_name"] = line
+            found = True
+        used += found
+    return contact, used
+
+
+def _parse_section(section: str, lines: List[str]) -> tuple[Any, int]:
+    """Parses the lines of one section; returns (section value, number of lines accounted for)."""
+    if section == "summary":
+        # Only the first paragraph: blank lines are gone after normalisation, so it ends with the first sentence-final line.
+        end = next((index + 1 for index, line in enumerate(lines) if line.endswith(_SENTENCE_END)), len(lines))
+        paragraph = lines[:min(end, SUMMARY_MAX_LINES)]
+        return " ".join(paragraph), len(paragraph)
+    if section == "skills":
+        skill_lines = [line for line in lines if _is_skills_line(line)]
+        return parse_skills("\n".join(skill_lines)), len(skill_lines)
+    if section == "languages":
+        items = [parse_language(line.lstrip("- ")) for line in lines]
+        return [_compact(item) for item in items if item], sum(1 for item in items if item)
+    if section == "work_experience":
+        _, entries = _split_entries(lines, _WORK_ENTRY_RE.match)
+        items = [parse_work_experience("\n".join(entry)) for entry in entries]
+        used = sum(1 + bool(item.get("location")) + len(item.get("description") or []) for item in items if item)
+        return [_compact(item) for item in items if item], used
+    if section == "education":
+        _, entries = _split_entries(lines, _EDUCATION_ENTRY_RE.match)
+        items = [parse_education("\n".join(entry)) for entry in entries]
+        used = sum(len(entry) for entry, item in zip(entries, items) if item)
+        return [_compact(item) for item in items if item], used
+    if section in _KEYED_PARSERS:
+        fields = _KEYED_FIELDS[section]
+        _, entries = _split_entries(lines, lambda line: line.lower().startswith(fields[0] + ":"))
+        items = [_KEYED_PARSERS[section]("\n".join(entry)) for entry in entries]
+        used = sum(1 for entry, item in zip(entries, items) if item
+                   for line in entry if line.split(":", 1)[0].strip().lower() in fields)
+        return [_compact(item) for item in items if item], used
+    return None, 0
+
+
+def parse_cv_text(cv_text: str) -> tuple[Optional[CVData], float]:
+    """
+    Parses CV text with standard headings and the entry formats of the scratch flow, without Gemini.
+    Returns the CVData (None if nothing usable was found) and a confidence between 0 and 1: the share of
+    non-empty lines that ended up in a field, lowered if the name or a way to contact is missing. Lines
+    under headings it doesn't know are left out and count against the confidence.
+    """
+    segments = cv_segmenter.segment_cv_text(cv_segmenter.normalize_cv_text(cv_text))
+    data: Dict[str, Any] = {}
+    total = used = 0
+    for section, section_text in segments.items():
+        lines = [_clean_line(line) for line in section_text.splitlines() if line.strip()]
+        total += len(lines)
+        if section == cv_segmenter.HEADER:
+            contact, section_used = _parse_header(lines)
+            if contact:
+                data["contact_info"] = contact
+        else:
+            value, section_used = _parse_section(section, _before_unknown_heading(lines))
+            if value:
+                data[section] = value
+        used += section_used
+
+    if not total or not (data.get("work_experience") or data.get("education")):
+        return None, 0.0
+    try:
+        cv_data = CVData.model_validate(data)
+    except ValidationError as e:
+        logger.debug(f"Local parse result did not validate: {e}")
+        return None, 0.0
+
+    confidence = used / total
+    contact = data.get("contact_info", {})
+    if "full_name" not in contact:
+        confidence *= 0.7
+    if "email" not in contact and "phone" not in contact:
+        confidence *= 0.7
+    return cv_data, confidence
+
+
+def try_parse_cv_text(cv_text: str) -> Optional[CVData]:
+    """
+    Returns the local parse of a CV if its confidence reaches LOCAL_PARSE_MIN_CONFIDENCE, otherwise None
+    (the caller then asks Gemini). Counts hits and misses and the Gemini time saved by hits, estimated
+    from the average duration of Gemini parses so far.
+    """
+    if not config.LOCAL_PARSER:
+        return None
+    started = time.monotonic()
+    try:
+        cv_data, confidence = parse_cv_text(cv_text)
+    except Exception as e:
+        logger.error(f"Local CV parse failed: {e}", exc_info=True)
+        metrics.inc("local_parse_total", result="error")
+        return None
+    elapsed = time.monotonic() - started
+    metrics.observe("local_parse_seconds", elapsed)
+
+    if cv_data is None or confidence < config.LOCAL_PARSE_MIN_CONFIDENCE:
+        metrics.inc("local_parse_total", result="miss")
+        logger.info(f"Local parse confidence {confidence:.2f} is below {config.LOCAL_PARSE_MIN_CONFIDENCE}, using Gemini")
+        return None
+
+    metrics.inc("local_parse_total", result="hit")
+    gemini_parses = metrics.get_summary("gemini_parse_seconds")
+    if gemini_parses:
+        count, total_seconds, _ = gemini_parses
+        metrics.inc("local_parse_seconds_saved_total", max(0.0, total_seconds / count - elapsed))
+    logger.info(f"Parsed CV locally with confidence {confidence:.2f} in {elapsed * 1000:.1f}ms")
+    return cv_data
@@ -1,21 +1,32 @@
 import logging
+import secrets
+import httpx
 import redis
+import redis.asyncio
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ContextTypes,
     filters,
     PicklePersistence, # Simple file-based persistence for easy start
-    # RedisPersistence, # Use this for Redis-backed persistence
     BasePersistence,
 )
+from telegram.request import HTTPXRequest
 from telegram.warnings import PTBUserWarning
 import warnings
 from telegram import Update
 
 import config
+import extraction_service
 import handlers
+import metrics
+import pdf_service
+import sessions
+from update_processor import PerUserUpdateProcessor
+from persistence import RedisPersistence
 
 warnings.filterwarnings("ignore", category=PTBUserWarning, message="State .* isn't part of any ConversationHandler")
 
@@ -31,14 +42,17 @@ def create_persistence() -> BasePersistence:
     """Creates the persistence object (Redis or Pickle)."""
     try:
         # Requires a running Redis server configured in .env
-        redis_instance = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB, decode_responses=True)
+        redis_instance = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB)
         redis_instance.ping() # Test connection
+        redis_instance.close()
         logger.info(f"Successfully connected to Redis at {config.REDIS_HOST}:{config.REDIS_PORT}")
-
-        # --- OR Simple Pickle Persistence (Easier for testing, not recommended for prod) ---
-        # Stores data in a file named 'bot_persistence.pkl' (default)
-        logger.warning("Using PicklePersistence. State will be lost if the bot restarts without the file. Use RedisPersistence for production.")
-        return PicklePersistence(filepath="bot_persistence.pkl")
+        return RedisPersistence(
+            redis.asyncio.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=config.REDIS_DB),
+            prefix=config.PERSISTENCE_KEY_PREFIX,
+            ttl=config.SESSION_IDLE_TTL, # Saved states expire like resident ones
+            state_ttls=config.SESSION_IDLE_TTLS,
+            update_interval=config.PERSISTENCE_UPDATE_INTERVAL,
+        )
 
     except redis.exceptions.ConnectionError as e:
          logger.error(f"Could not connect to Redis at {config.REDIS_HOST}:{config.REDIS_PORT}. Error: {e}")
@@ -49,6 +63,53 @@ def create_persistence() -> BasePersistence:
          logger.warning("Falling back to PicklePersistence.")
          return PicklePersistence(filepath="bot_persistence.pkl")
 
+class KeepAliveHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest whose idle keep-alive connections live for `keepalive_expiry` seconds (httpx defaults to 5)."""
+
+    def __init__(self, connection_pool_size: int, keepalive_expiry: float, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        # HTTPXRequest has no option for the expiry, so this rebuilds its client with adjusted limits. That relies
+        # on the private _client_kwargs and _build_client of python-telegram-bot 20.6 (pinned in requirements.txt);
+        # if they change, keep PTB's client and httpx's default expiry rather than fail.
+        if not isinstance(getattr(self, "_client_kwargs", None), dict) or not hasattr(self, "_build_client"):
+            logger.warning("Cannot set the Bot API keep-alive expiry with this python-telegram-bot version")
+            return
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=connection_pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._client = self._build_client()
+
+def create_request(connection_pool_size: int) -> HTTPXRequest:
+    """Creates the HTTP client for Bot API calls (long timeouts for PDF uploads)."""
+    return KeepAliveHTTPXRequest(
+        connection_pool_size=connection_pool_size,
+        keepalive_expiry=config.BOT_API_KEEPALIVE,
+        read_timeout=100,
+        write_timeout=100,
+        pool_timeout=config.BOT_API_POOL_TIMEOUT,
+    )
+
+async def log_metrics(context: ContextTypes.DEFAULT_TYPE):
+    metrics.log_snapshot()
+
+async def post_init(application: Application):
+    """Starts background services once the event loop is running."""
+    pdf_service.verify_templates()
+    pdf_service.render_pool.start()
+    extraction_service.extraction_pool.start()
+    application.create_task(pdf_service.prepare_sample_thumbnails())
+    if config.METRICS_LOG_INTERVAL and application.job_queue:
+        application.job_queue.run_repeating(log_metrics, interval=config.METRICS_LOG_INTERVAL, first=config.METRICS_LOG_INTERVAL)
+    if config.SESSION_SWEEP_INTERVAL and application.job_queue:
+        application.job_queue.run_repeating(sessions.sweep, interval=config.SESSION_SWEEP_INTERVAL, first=config.SESSION_SWEEP_INTERVAL)
+
+async def post_shutdown(application: Application):
+    """Stops background services after the bot has stopped."""
+    pdf_service.render_pool.shutdown()
+    extraction_service.extraction_pool.shutdown()
+
 def main():
     """Starts the CVBuilder bot."""
     logger.info("Starting CVBuilder Bot...")
@@ -66,11 +127,15 @@ def main():
         ApplicationBuilder()
         .token(config.TELEGRAM_BOT_TOKEN)
         .persistence(persistence)
-        .read_timeout(100)
-        .write_timeout(100)
+        .concurrent_updates(PerUserUpdateProcessor(config.UPDATE_CONCURRENCY, config.UPDATE_MAX_PENDING))
+        .request(create_request(config.BOT_API_POOL_SIZE))
+        .get_updates_request(create_request(1)) # Only used for polling, one long-poll at a time
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
+    application.add_handler(handlers.activity_handler, group=-1)
     application.add_handler(handlers.start_handler)
     application.add_handler(handlers.help_handler)
     application.add_handler(handlers.message_handler)
@@ -78,8 +143,23 @@ def main():
     application.add_handler(handlers.callback_query_handler)
 
 
-    logger.info("Bot application built. Starting polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.WEBHOOK_URL:
+        # Telegram sends the secret with every update; requests without it are rejected.
+        secret_token = config.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        webhook_url = f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}"
+        logger.info(f"Bot application built. Serving webhook on {config.WEBHOOK_LISTEN}:{config.WEBHOOK_PORT} for {webhook_url}...")
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=secret_token,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        logger.info("Bot application built. Starting polling...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
     logger.info("Bot stopped.")
 
 
@@ -0,0 +1,77 @@
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Minimal in-process metrics: monotonically increasing counters, point-in-time gauges and
+# latency summaries, identified by name plus optional labels. Logged periodically by main.py.
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_gauges: dict[str, float] = {}
+_summaries: dict[str, list[float]] = {} # name -> [count, sum, max]
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def remove_gauge(name: str, **labels):
+    with _lock:
+        _gauges.pop(_key(name, labels), None)
+
+
+def observe(name: str, value: float, **labels):
+    """Records one observation (e.g. a latency in seconds) into a count/sum/max summary."""
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = max(summary[2], value)
+
+
+def get_counter(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def get_summary(name: str, **labels) -> Optional[tuple[int, float, float]]:
+    """Returns (count, sum, max) of a summary, or None if nothing was observed."""
+    with _lock:
+        summary = _summaries.get(_key(name, labels))
+        return tuple(summary) if summary else None
+
+
+def snapshot() -> dict[str, float]:
+    """All current values; summaries are flattened into _count, _sum and _max entries."""
+    with _lock:
+        values = dict(_counters)
+        values.update(_gauges)
+        for key, (count, total, maximum) in _summaries.items():
+            name, _, labels = key.partition("{")
+            suffix = "{" + labels if labels else ""
+            values[f"{name}_count{suffix}"] = count
+            values[f"{name}_sum{suffix}"] = total
+            values[f"{name}_max{suffix}"] = maximum
+    return values
+
+
+def log_snapshot():
+    values = snapshot()
+    if values:
+        logger.info("Metrics: " + ", ".join(f"{key}={value:g}" for key, value in sorted(values.items())))
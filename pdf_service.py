@@ -1,22 +1,261 @@
 import logging
+import asyncio
+import hashlib
+import importlib.util
+import io
 from pathlib import Path
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from weasyprint import HTML
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
 from typing import Optional
 from schemas import CVData
 from config import TEMPLATES
+import config
+from cache import create_cache
+from single_flight import SingleFlight
+from worker_pool import WorkerPool, WorkerPoolBusy, WorkerPoolError
 
 logger = logging.getLogger(__name__)
 
 TEMPLATE_DIR = Path(__file__).parent / "templates"
+
+# Compiled templates persist across restarts and are shared by all workers. Jinja keys them by
+# source checksum, so an edited template is never served from stale bytecode.
+bytecode_cache = None
+if config.TEMPLATE_BYTECODE_CACHE_DIR:
+    Path(config.TEMPLATE_BYTECODE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    bytecode_cache = FileSystemBytecodeCache(config.TEMPLATE_BYTECODE_CACHE_DIR)
+
 env = Environment(
     loader=FileSystemLoader(TEMPLATE_DIR),
-    autoescape=select_autoescape(['html', 'xml'])
+    autoescape=select_autoescape(['html', 'xml']),
+    auto_reload=not config.PRODUCTION, # In production templates are immutable, skip the stat() per render
+    bytecode_cache=bytecode_cache,
+)
+
+
+# Shared by every stylesheet and render in this process, so fonts are discovered through fontconfig once.
+font_config = FontConfiguration()
+
+# Compiled stylesheets of this process, keyed by CSS file name; recompiled if the file's digest changes.
+_stylesheets: dict[str, tuple[str, CSS]] = {}
+
+# Placeholder CV used to warm up render workers.
+SAMPLE_CV = CVData.model_validate({
+    "contact_info": {"full_name": "Alex Morgan", "email": "alex.morgan@example.com", "phone": "+1 555 0100",
+                     "linkedin_url": "https://www.linkedin.com/in/alex-morgan", "address": "Berlin, Germany"},
+    "summary": "Backend engineer with seven years of experience building reliable, data-heavy web services.",
+    "work_experience": [{"job_title": "Senior Software Engineer", "company": "Northwind", "location": "Berlin",
+                         "start_date": "2021-03", "end_date": "Present",
+                         "description": ["Led the migration to an event-driven billing platform.",
+                                         "Cut p99 API latency by 40% through query and cache tuning."]}],
+    "education": [{"degree": "B.Sc. in Computer Science", "institution": "TU Munich", "graduation_date": "2017"}],
+    "skills": [{"category": "Programming Languages", "skills_list": ["Python", "Go", "SQL"]}],
+    "projects": [{"project_name": "queue-lens", "description": "Open-source dashboard for message queue backlogs.",
+                  "technologies": ["Python", "Redis"]}],
+    "languages": [{"language": "English", "proficiency": "Fluent"}, {"language": "German", "proficiency": "Native"}],
+})
+
+
+def get_stylesheet(template_key: str) -> CSS:
+    """Returns the compiled stylesheet of a template, parsing its CSS file only on first use or after edits."""
+    css_filename = TEMPLATES[template_key]["css"]
+    digest = template_digest(css_filename)
+    cached = _stylesheets.get(css_filename)
+    if cached and cached[0] == digest:
+        return cached[1]
+    stylesheet = CSS(filename=str(TEMPLATE_DIR / css_filename), font_config=font_config)
+    _stylesheets[css_filename] = (digest, stylesheet)
+    return stylesheet
+
+
+def _render_document(cv_data: CVData, template_key: str, **options):
+    """Lays out a CV with WeasyPrint and returns the rendered Document. `options` go to HTML.render."""
+    template_filename = TEMPLATES[template_key]["file"]
+    template = env.get_template(template_filename)
+
+    rendered_html = template.render(cv=cv_data)
+
+    logger.info(f"Rendering PDF using template: {template_filename}")
+
+    html = HTML(string=rendered_html, base_url=str(TEMPLATE_DIR))
+    return html.render(stylesheets=[get_stylesheet(template_key)], font_config=font_config, **options)
+
+
+# Output profiles trade a little render CPU for smaller files (and faster uploads to Telegram).
+# Render options go to HTML.render: WeasyPrint 59 reads the image options while laying out raster images,
+# and ignores them in write_pdf. Font subsetting and compressed streams are its defaults in both profiles.
+OUTPUT_PROFILES = {
+    "standard": {"render_options": {}, "strip_metadata": False},
+    "compact": {
+        "render_options": {"optimize_images": True, "jpeg_quality": 75, "dpi": 150},
+        "strip_metadata": True,
+    },
+}
+
+
+def _strip_metadata(document):
+    metadata = document.metadata
+    metadata.title = None
+    metadata.authors = []
+    metadata.description = None
+    metadata.keywords = []
+    metadata.generator = None
+    metadata.created = None
+    metadata.modified = None
+
+
+def _render(cv_data: CVData, template_key: str, profile: str = "standard") -> bytes:
+    output_profile = OUTPUT_PROFILES[profile]
+    document = _render_document(cv_data, template_key, **output_profile["render_options"])
+    if output_profile["strip_metadata"]:
+        _strip_metadata(document)
+    return document.write_pdf()
+
+
+def _rasterize_first_page(pdf_bytes: bytes, dpi: int) -> bytes:
+    """Converts page one of a PDF to PNG bytes. WeasyPrint has no raster output, so pypdfium2 does this."""
+    import pypdfium2 # Optional dependency, only needed for previews
+
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        image = pdf[0].render(scale=dpi / 72).to_pil()
+    finally:
+        pdf.close()
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def init_render_worker():
+    """
+    Runs once in every render process: WeasyPrint is imported with this module, templates and
+    stylesheets are compiled here, and one warm-up render per template loads the fonts.
+    """
+    for template_key, details in TEMPLATES.items():
+        env.get_template(details["file"])
+        get_stylesheet(template_key)
+        try:
+            _render(SAMPLE_CV, template_key)
+        except Exception as e:
+            logger.error(f"Warm-up render failed for template {template_key}: {e}", exc_info=True)
+    logger.info("Render worker ready")
+
+
+def render_pdf(cv_json: str, template_key: str, profile: str = "standard") -> bytes:
+    """Renders a CV to PDF bytes with the given output profile. Runs inside a render worker process."""
+    return _render(CVData.model_validate_json(cv_json), template_key, profile)
+
+
+def render_preview_png(cv_json: str, template_key: str, dpi: int) -> bytes:
+    """Renders a low-resolution PNG of a CV's first page. Runs inside a render worker process."""
+    document = _render_document(CVData.model_validate_json(cv_json), template_key)
+    first_page_pdf = document.copy(document.pages[:1]).write_pdf()
+    return _rasterize_first_page(first_page_pdf, dpi)
+
+
+render_pool = WorkerPool(
+    "render",
+    processes=config.PDF_RENDER_WORKERS,
+    max_queue=config.PDF_RENDER_MAX_QUEUE,
+    job_timeout=config.PDF_RENDER_TIMEOUT,
+    initializer=init_render_worker,
+    max_jobs_per_worker=config.PDF_RENDER_MAX_JOBS_PER_WORKER,
+    max_rss_bytes=config.PDF_RENDER_MAX_RSS_MB * 1024 * 1024,
 )
 
 
+pdf_cache = create_cache(
+    "pdf",
+    max_bytes=config.PDF_CACHE_MAX_BYTES,
+    backend=config.PDF_CACHE_BACKEND,
+    ttl=config.PDF_CACHE_TTL,
+    directory=Path(config.PDF_CACHE_DIR),
+    disk_max_bytes=config.PDF_CACHE_DISK_MAX_BYTES,
+)
+
+# Identical renders requested while one is running (double taps, speculative renders) share it.
+render_flights = SingleFlight("render")
+
+async def _render_cached(cache_key: str, func, *args) -> bytes:
+    """Runs a render job in the pool and caches its output; coalesced per cache key by the caller."""
+    output = await render_pool.submit(func, *args)
+    await pdf_cache.set(cache_key, output)
+    return output
+
+# Telegram file_id of every PDF or preview image already uploaded, keyed by the SHA-256 of its bytes.
+sent_file_ids = create_cache(
+    "pdf_file_ids",
+    max_bytes=config.PDF_FILE_ID_CACHE_MAX_BYTES,
+    backend=config.PDF_CACHE_BACKEND,
+    ttl=config.PDF_CACHE_TTL,
+    directory=Path(config.PDF_CACHE_DIR) / "file_ids",
+)
+
+async def get_sent_file_id(content_digest: str) -> Optional[str]:
+    """Returns the Telegram file_id of an identical file sent before, if any."""
+    file_id = await sent_file_ids.get(content_digest)
+    return file_id.decode("utf-8") if file_id is not None else None
+
+async def remember_sent_file_id(content_digest: str, file_id: str):
+    await sent_file_ids.set(content_digest, file_id.encode("utf-8"))
+
+_template_digests: dict[str, tuple[tuple[int, int], str]] = {}
+
+def template_digest(template_filename: str) -> str:
+    """
+    SHA-256 of a template file, recomputed only when its size or mtime changes.
+    In production the first digest is kept, as templates are not reloaded there.
+    """
+    cached = _template_digests.get(template_filename)
+    if cached and config.PRODUCTION:
+        return cached[1]
+    stat = (TEMPLATE_DIR / template_filename).stat()
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = hashlib.sha256((TEMPLATE_DIR / template_filename).read_bytes()).hexdigest()
+    _template_digests[template_filename] = (signature, digest)
+    return digest
+
+def template_set_digest() -> str:
+    """Combined digest of every template's HTML and CSS file."""
+    combined = hashlib.sha256()
+    for details in TEMPLATES.values():
+        for filename in (details["file"], details["css"]):
+            combined.update(f"{filename}\0{template_digest(filename)}\n".encode("utf-8"))
+    return combined.hexdigest()
+
+def verify_templates():
+    """
+    Startup check of the template files: fails if TEMPLATE_DIGEST is set and doesn't match, clears
+    the bytecode cache if the templates changed since the last start, then precompiles every template
+    so render workers load bytecode instead of compiling from source.
+    """
+    digest = template_set_digest()
+    if config.TEMPLATE_DIGEST and config.TEMPLATE_DIGEST != digest:
+        raise RuntimeError(f"Template digest mismatch: expected {config.TEMPLATE_DIGEST}, found {digest}")
+
+    if bytecode_cache is not None:
+        stamp_path = Path(config.TEMPLATE_BYTECODE_CACHE_DIR) / "templates.sha256"
+        previous_digest = stamp_path.read_text().strip() if stamp_path.is_file() else None
+        if previous_digest != digest:
+            bytecode_cache.clear() # Drop bytecode of old template versions
+            stamp_path.write_text(digest)
+
+    for details in TEMPLATES.values():
+        env.get_template(details["file"])
+    logger.info(f"Templates verified and precompiled (digest {digest})")
+
+def pdf_cache_key(cv_json: str, template_key: str, variant: str = "pdf") -> str:
+    """Content address of a render: CV data, template choice, the template files' current contents and output variant."""
+    template = TEMPLATES[template_key]
+    key_source = "\0".join([cv_json, template_key, template_digest(template["file"]), template_digest(template["css"]), variant])
+    return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+
 async def generate_cv_pdf(cv_data: CVData, template_key: str) -> Optional[bytes]:
-    """Generates a PDF CV using WeasyPrint and Jinja2."""
+    """Generates a PDF CV using WeasyPrint and Jinja2 in the render worker pool."""
     if template_key not in TEMPLATES:
         logger.error(f"Invalid template key specified: {template_key}")
         return None
@@ -28,21 +267,65 @@ async def generate_cv_pdf(cv_data: CVData, template_key: str) -> Optional[bytes]
         logger.error(f"Template file not found: {template_path}")
         return None
 
-    try:
-        template = env.get_template(template_filename)
-        
-        rendered_html = template.render(cv=cv_data) 
-
-        logger.info(f"Rendering PDF using template: {template_filename}")
-        
-        html = HTML(string=rendered_html, base_url=str(TEMPLATE_DIR))
+    profile = config.PDF_OUTPUT_PROFILE
+    if profile not in OUTPUT_PROFILES:
+        logger.warning(f"Unknown PDF output profile '{profile}', using 'standard'")
+        profile = "standard"
 
+    cv_json = cv_data.model_dump_json()
+    cache_key = pdf_cache_key(cv_json, template_key, variant=f"pdf:{profile}")
+    pdf_bytes = await pdf_cache.get(cache_key)
+    if pdf_bytes is not None:
+        logger.info(f"Serving cached PDF for template {template_key}")
+        return pdf_bytes
 
-        pdf_bytes = html.write_pdf()
+    try:
+        pdf_bytes = await render_flights.run(cache_key, _render_cached, cache_key, render_pdf, cv_json, template_key, profile)
 
         logger.info(f"Successfully generated PDF for template {template_key}")
         return pdf_bytes
 
-    except Exception as e:
-        logger.error(f"Error generating PDF for template {template_key}: {e}", exc_info=True)
-        return None
\ No newline at end of file
+    except WorkerPoolBusy as e:
+        logger.warning(f"Render queue full, rejecting PDF for template {template_key}: {e}")
+        return None
+    except WorkerPoolError as e:
+        logger.error(f"Error generating PDF for template {template_key}: {e}")
+        return None
+
+
+# PNG previews of every template rendered with SAMPLE_CV, filled once at startup.
+sample_thumbnails: dict[str, bytes] = {}
+
+def previews_available() -> bool:
+    return config.TEMPLATE_PREVIEWS and importlib.util.find_spec("pypdfium2") is not None
+
+
+async def generate_preview_png(cv_data: CVData, template_key: str) -> Optional[bytes]:
+    """Generates a low-DPI PNG of the first page of a CV in the given template, using the render pool and cache."""
+    if template_key not in TEMPLATES or not previews_available():
+        return None
+
+    cv_json = cv_data.model_dump_json()
+    cache_key = pdf_cache_key(cv_json, template_key, variant=f"preview@{config.TEMPLATE_PREVIEW_DPI}")
+    png_bytes = await pdf_cache.get(cache_key)
+    if png_bytes is not None:
+        return png_bytes
+
+    try:
+        return await render_flights.run(cache_key, _render_cached, cache_key, render_preview_png,
+                                        cv_json, template_key, config.TEMPLATE_PREVIEW_DPI)
+    except WorkerPoolError as e:
+        logger.warning(f"Could not render preview for template {template_key}: {e}")
+        return None
+
+
+async def prepare_sample_thumbnails():
+    """Renders the sample thumbnails of all templates. Called in the background at startup."""
+    if not previews_available():
+        logger.info("Template previews disabled or pypdfium2 not installed, skipping sample thumbnails.")
+        return
+    results = await asyncio.gather(*(generate_preview_png(SAMPLE_CV, key) for key in TEMPLATES))
+    for template_key, png_bytes in zip(TEMPLATES, results):
+        if png_bytes:
+            sample_thumbnails[template_key] = png_bytes
+    logger.info(f"Prepared {len(sample_thumbnails)} sample template thumbnail(s)")
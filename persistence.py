@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import logging
+import pickle
+import time
+from typing import Any, Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+from telegram.ext._utils.types import ConversationDict, CDCData
+
+import metrics
+from state_codec import decode_user_data, encode_user_data
+
+logger = logging.getLogger(__name__)
+
+RETRY_MIN_DELAY = 1 # Seconds before retrying a failed write; doubles after each failure
+RETRY_MAX_DELAY = 60
+
+
+class RedisPersistence(BasePersistence):
+    """
+    Persistence on Redis with one key per user, so the cost of saving is proportional to the users
+    active since the last save, not to all users ever seen.
+
+    - User data is loaded lazily: nothing is read at startup, and a user's state is fetched the first
+      time one of their updates is processed (refresh_user_data).
+    - Only users whose serialised state actually changed are written, all in one pipeline per
+      persistence run; empty state deletes the key. A failed write is retried with exponential backoff.
+    - Each write sets the key's TTL (`state_ttls` gives conversation states their own instead of
+      `ttl`), so abandoned sessions expire on their own. An unchanged state isn't rewritten, so its key
+      keeps counting down; it is rewritten once half its TTL has passed, if the user is still active.
+    - evict_user_data always writes a state, whether or not it changed, so it can be dropped from
+      memory; it is loaded again with the user's next update.
+
+    Only user_data and conversation states are stored (the bot keeps no chat or bot data).
+    `client` is a redis.asyncio.Redis created with decode_responses=False, or a compatible fake.
+    """
+
+    def __init__(self, client, prefix: str = "cvbuilder:persistence", ttl: Optional[float] = None,
+                 state_ttls: Optional[Dict[str, float]] = None, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.client = client
+        self.prefix = prefix
+        self.ttl = int(ttl) if ttl else None
+        self.state_ttls = {state: int(seconds) if seconds else None for state, seconds in (state_ttls or {}).items()}
+        self._loaded: set[int] = set() # Users whose stored state was already merged into user_data
+        self._written: Dict[int, tuple[bytes, float]] = {} # Digest and monotonic time of the last state written per user
+        self._pending: Dict[int, Optional[tuple[bytes, Optional[int]]]] = {} # Staged (payload, TTL), None = delete
+        self._write_task: Optional[asyncio.Task] = None
+        self._retry: Optional[asyncio.TimerHandle] = None
+        self._retry_delay = 0.0
+
+    def _user_key(self, user_id: int) -> str:
+        return f"{self.prefix}:user:{user_id}"
+
+    def _conversations_key(self, name: str) -> str:
+        return f"{self.prefix}:conversations:{name}"
+
+    # --- Writes: staged per user and sent in one pipeline ---
+
+    def _stage(self, user_id: int, data: Dict[Any, Any], force: bool = False):
+        payload = encode_user_data(data) if data else None
+        digest = hashlib.sha256(payload).digest() if payload is not None else b""
+        ttl = self.state_ttls.get(data.get("state"), self.ttl)
+        written = self._written.get(user_id)
+        if (not force and written is not None and written[0] == digest and user_id not in self._pending
+                and (not ttl or time.monotonic() - written[1] < ttl / 2)):
+            metrics.inc("persistence_writes_total", result="unchanged")
+            return # Unchanged since the last write, and its key is far from expiring
+        self._pending[user_id] = None if payload is None else (payload, ttl)
+        if self._retry is None: # Otherwise it goes out with the scheduled retry
+            self._start_writing()
+
+    def _start_writing(self):
+        self._retry = None
+        if self._pending and (self._write_task is None or self._write_task.done()):
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # Persistence runs call update_user_data for all users at once; yield so they are all staged first.
+        await asyncio.sleep(0)
+        while self._pending: # Writes staged while a batch was in flight go out in the next one
+            batch, self._pending = self._pending, {}
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for user_id, entry in batch.items():
+                        if entry is None:
+                            pipe.delete(self._user_key(user_id))
+                        else:
+                            pipe.set(self._user_key(user_id), entry[0], ex=entry[1])
+                    await pipe.execute()
+            except Exception as e:
+                self._retry_delay = min(RETRY_MAX_DELAY, self._retry_delay * 2) or RETRY_MIN_DELAY
+                logger.error(f"Writing {len(batch)} user state(s) to Redis failed, retrying in {self._retry_delay:g}s: {e}")
+                metrics.inc("persistence_writes_total", len(batch), result="error")
+                for user_id, entry in batch.items():
+                    self._pending.setdefault(user_id, entry)
+                self._retry = asyncio.get_running_loop().call_later(self._retry_delay, self._start_writing)
+                return
+            self._retry_delay = 0.0
+            written_at = time.monotonic()
+            for user_id, entry in batch.items():
+                if entry is None:
+                    self._written.pop(user_id, None)
+                else:
+                    self._written[user_id] = (hashlib.sha256(entry[0]).digest(), written_at)
+            metrics.inc("persistence_writes_total", len(batch), result="written")
+            logger.debug(f"Persisted {len(batch)} user state(s) to Redis")
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        self._stage(user_id, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded.discard(user_id)
+        self._stage(user_id, {})
+
+    async def evict_user_data(self, user_id: int, data: Dict[Any, Any]) -> bool:
+        """
+        Writes a user's state now so the caller can drop it from memory; refresh_user_data loads it
+        again with their next update. Returns False if the write failed and the state must stay resident.
+        Writes even an unchanged state: its key may have expired meanwhile, and the write renews its TTL.
+        """
+        self._stage(user_id, data, force=True)
+        if self._write_task is not None:
+            await self._write_task
+        if user_id in self._pending:
+            return False
+        self._loaded.discard(user_id)
+        self._written.pop(user_id, None)
+        return True
+
+    async def flush(self) -> None:
+        if self._write_task is not None:
+            await self._write_task
+        if self._retry is not None:
+            self._retry.cancel() # Last attempt now; the loop is about to stop
+            self._retry = None
+        if self._pending:
+            await self._write_pending()
+            if self._retry is not None:
+                self._retry.cancel()
+                logger.error(f"{len(self._pending)} user state(s) were not saved to Redis")
+        await self.client.aclose()
+
+    # --- Reads: lazy, one user at a time ---
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {} # Filled per user by refresh_user_data
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id in self._loaded:
+            return
+        try:
+            payload = await self.client.get(self._user_key(user_id))
+        except Exception as e:
+            logger.error(f"Loading the state of user {user_id} from Redis failed: {e}")
+            return # Try again with their next update
+        self._loaded.add(user_id)
+        if payload is None:
+            return
+        try:
+            stored = decode_user_data(payload)
+        except Exception as e:
+            logger.error(f"Discarding unreadable stored state of user {user_id}: {e}")
+            return
+        # Its TTL is unknown here, so the first unchanged save after loading renews it.
+        self._written[user_id] = (hashlib.sha256(payload).digest(), float("-inf"))
+        for key, value in stored.items():
+            user_data.setdefault(key, value) # Anything set before loading wins
+
+    # --- Conversation states (one hash per ConversationHandler) ---
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        stored = await self.client.hgetall(self._conversations_key(name))
+        return {tuple(pickle.loads(key)): pickle.loads(state) for key, state in stored.items()}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        field = pickle.dumps(list(key))
+        if new_state is None:
+            await self.client.hdel(self._conversations_key(name), field)
+        else:
+            await self.client.hset(self._conversations_key(name), field, pickle.dumps(new_state))
+
+    # --- Not stored by this bot ---
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> Optional[CDCData]:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data: CDCData) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
@@ -0,0 +1,118 @@
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+import telegram
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+import config
+import metrics
+from persistence import RedisPersistence
+from update_processor import PerUserUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Monotonic time of each user's last update, least recently active first.
+_last_seen: OrderedDict[int, float] = OrderedDict()
+MIN_IDLE_FOR_EVICTION = 60 # Seconds; recently active users are likely to send more updates
+# _unload relies on Application internals of these python-telegram-bot versions (see requirements.txt).
+UNLOAD_TESTED_VERSIONS = ((20, 6),)
+
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Records the user's activity; runs before the real handlers (group -1)."""
+    user = update.effective_user
+    if user:
+        _last_seen[user.id] = time.monotonic()
+        _last_seen.move_to_end(user.id)
+
+
+def _idle_ttl(user_data: dict) -> float:
+    return config.SESSION_IDLE_TTLS.get(user_data.get("state"), config.SESSION_IDLE_TTL)
+
+
+def _deep_sizeof(obj) -> int:
+    """Approximate memory held by a user_data dict (containers and their contents)."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(key) + _deep_sizeof(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_sizeof(item) for item in obj)
+    return size
+
+
+def _is_busy(application: Application, user_id: int) -> bool:
+    processor = application.update_processor
+    return isinstance(processor, PerUserUpdateProcessor) and processor.is_busy(user_id)
+
+
+def _can_unload(application: Application) -> bool:
+    return (telegram.__version_info__[:2] in UNLOAD_TESTED_VERSIONS and hasattr(application, "_user_data")
+            and hasattr(application, "_user_ids_to_be_updated_in_persistence"))
+
+
+def _unload(application: Application, user_id: int):
+    """
+    Removes a user's data from memory without deleting their persisted state. Application has no public
+    way to do this (drop_user_data deletes it from persistence too), so this is the only place touching
+    its private attributes; sweep checks _can_unload first.
+    """
+    application._user_data.pop(user_id, None)
+    application._user_ids_to_be_updated_in_persistence.discard(user_id)
+
+
+async def _evict(application: Application, user_id: int) -> bool:
+    seen = _last_seen.get(user_id)
+    if user_id not in application.user_data or _is_busy(application, user_id):
+        return False
+    if not await application.persistence.evict_user_data(user_id, application.user_data[user_id]):
+        return False
+    if _last_seen.get(user_id) != seen or _is_busy(application, user_id):
+        return False # An update arrived while saving; keep the live state
+    _unload(application, user_id)
+    del _last_seen[user_id]
+    return True
+
+
+async def sweep(context: ContextTypes.DEFAULT_TYPE):
+    """Drops sessions idle past their state's TTL, evicts the least recently active ones over the cap."""
+    application = context.application
+    now = time.monotonic()
+    for user_id in list(_last_seen):
+        if user_id not in application.user_data:
+            del _last_seen[user_id] # Dropped elsewhere
+    for user_id in application.user_data:
+        if user_id not in _last_seen: # Loaded at startup; count idle time from now
+            _last_seen[user_id] = now
+            _last_seen.move_to_end(user_id, last=False)
+
+    expired = 0
+    for user_id, seen in list(_last_seen.items()):
+        ttl = _idle_ttl(application.user_data[user_id])
+        if ttl and now - seen >= ttl and not _is_busy(application, user_id):
+            application.drop_user_data(user_id)
+            import speculation # Lazy: pulls in the PDF renderer
+            speculation.cancel(user_id)
+            del _last_seen[user_id]
+            expired += 1
+
+    evicted = 0
+    excess = len(_last_seen) - config.SESSION_MAX_RESIDENT
+    if config.SESSION_MAX_RESIDENT and excess > 0 and isinstance(application.persistence, RedisPersistence):
+        if not _can_unload(application):
+            logger.warning(f"Not evicting sessions: unsupported python-telegram-bot {telegram.__version__}")
+        else:
+            for user_id, seen in list(_last_seen.items()):
+                if evicted >= excess or now - seen < MIN_IDLE_FOR_EVICTION:
+                    break
+                if await _evict(application, user_id):
+                    evicted += 1
+
+    if expired or evicted:
+        metrics.inc("sessions_evicted_total", expired, reason="expired")
+        metrics.inc("sessions_evicted_total", evicted, reason="lru")
+        logger.info(f"Session sweep: {expired} expired, {evicted} evicted to persistence")
+    metrics.set_gauge("sessions_resident", len(application.user_data))
+    metrics.set_gauge("sessions_resident_bytes", sum(_deep_sizeof(data) for data in application.user_data.values()))
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key (e.g. a content hash) onto one task: the first
+    caller starts the work, callers arriving while it runs await the same result or exception.
+    A caller being cancelled doesn't affect the others; the work is cancelled only once every
+    caller has gone. Nothing is remembered after completion (that's what the caches are for).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[str, _Flight] = {}
+
+    def _forget(self, key: str, task: asyncio.Task):
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is task:
+            del self._flights[key]
+
+    async def run(self, key: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Returns the result of `func(*args, **kwargs)`, sharing it with concurrent calls for the same key."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(func(*args, **kwargs)))
+            flight.task.add_done_callback(lambda task: self._forget(key, task))
+            self._flights[key] = flight
+            metrics.inc("single_flight_total", group=self.name, result="leader")
+        else:
+            metrics.inc("single_flight_total", group=self.name, result="shared")
+            logger.info(f"Joining in-flight {self.name} job instead of starting a duplicate")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller was cancelled. Forget the flight now, not in its done-callback, so a caller
+                # arriving before the task has unwound starts fresh instead of joining a cancelled task.
+                self._forget(key, flight.task)
+                flight.task.cancel()
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from typing import Optional
+
+import config
+import pdf_service
+import worker_pool
+from schemas import CVData
+
+logger = logging.getLogger(__name__)
+
+# Speculative render tasks per user, keyed by template key, with an event set once the render got a
+# worker. Finished renders land in the PDF cache.
+_tasks: dict[int, dict[str, tuple[asyncio.Task, asyncio.Event]]] = {}
+_reserved = 0 # Speculative renders started and not finished yet, across all users
+
+
+def _release_budget(task: asyncio.Task):
+    # A done-callback rather than try/finally: tasks cancelled before they start never run their body.
+    global _reserved
+    _reserved -= 1
+
+
+def _forget(user_id: int, template_key: str, task: asyncio.Task):
+    user_tasks = _tasks.get(user_id)
+    if user_tasks and user_tasks.get(template_key, (None,))[0] is task:
+        del user_tasks[template_key]
+        if not user_tasks:
+            del _tasks[user_id]
+
+
+def start(user_id: int, cv_data: CVData):
+    """
+    Starts background renders of every template for a confirmed CV, as far as the global
+    speculation budget allows. Never competes with real work: nothing is started while
+    the render pool already has a backlog.
+    """
+    global _reserved
+    if not config.SPECULATIVE_RENDERING:
+        return
+    cancel(user_id)
+    pool = pdf_service.render_pool
+    if not pool.started or pool.pending >= pool.processes:
+        logger.debug(f"Render pool busy, skipping speculative renders for user {user_id}")
+        return
+
+    user_tasks = {}
+    for template_key in config.TEMPLATES:
+        if _reserved >= config.SPECULATIVE_RENDER_BUDGET:
+            break
+        _reserved += 1
+        started = asyncio.Event()
+        task = asyncio.create_task(_render(cv_data, template_key, started))
+        task.add_done_callback(_release_budget)
+        task.add_done_callback(lambda done, key=template_key: _forget(user_id, key, done))
+        user_tasks[template_key] = (task, started)
+    if user_tasks:
+        _tasks[user_id] = user_tasks
+        logger.info(f"Started {len(user_tasks)} speculative render(s) for user {user_id}")
+
+
+async def _render(cv_data: CVData, template_key: str, started: asyncio.Event):
+    # The render's single-flight task inherits this context, so the pool sets `started` when it gets a worker.
+    worker_pool.job_started.set(started)
+    await pdf_service.generate_cv_pdf(cv_data, template_key)
+
+
+async def wait(user_id: int, template_key: str):
+    """
+    Waits for the user's speculative render of `template_key` if one is running. Afterwards
+    the PDF is in the cache unless the render failed. The user's other speculative renders are
+    detached and left to finish, bounded by the budget, in case they pick another template.
+    """
+    entry: Optional[tuple[asyncio.Task, asyncio.Event]] = _tasks.pop(user_id, {}).get(template_key)
+    if entry is None:
+        return
+    task = entry[0]
+    try:
+        await asyncio.shield(task) # Our caller being cancelled must not cancel a render others may reuse
+    except asyncio.CancelledError:
+        if not task.cancelled():
+            raise # We were cancelled ourselves, not the speculative task
+    except Exception as e:
+        logger.warning(f"Speculative render of {template_key} failed for user {user_id}: {e}")
+
+
+def cancel(user_id: int):
+    """
+    Cancels a user's speculative renders (e.g. when they restart or their data changed) that are still
+    waiting for a worker. Renders already running are left to finish into the cache: cancelling them
+    would kill their workers.
+    """
+    for task, started in _tasks.pop(user_id, {}).values():
+        if not started.is_set():
+            task.cancel()
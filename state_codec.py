@@ -0,0 +1,127 @@
+import json
+import math
+import pickle
+import zlib
+from typing import Any, Dict
+
+import config
+
+try:
+    import orjson # Optional: several times faster than the json module
+except ImportError:
+    orjson = None
+
+# Payload layout: one format byte, then the body. Pickle payloads start with the PROTO opcode (0x80),
+# so states written before this codec existed are still read.
+FORMAT_JSON = 0x01 # Version 1 envelope as JSON
+FORMAT_JSON_ZLIB = 0x02 # Same, zlib-compressed
+FORMAT_PICKLE = 0x80
+CODEC_VERSION = 1
+COMPRESS_MIN_BYTES = 512 # Smaller bodies rarely get shorter when compressed
+COMPRESSION_LEVEL = 6
+
+# Conversation states are stored as their index here; append new states, never reorder.
+STATES = (
+    config.STATE_START,
+    config.STATE_AWAITING_CHOICE,
+    config.STATE_SCRATCH_START,
+    config.STATE_SCRATCH_AWAIT_DATA,
+    config.STATE_UPLOAD_AWAIT_FILE,
+    config.STATE_UPLOAD_PARSING,
+    config.STATE_REVIEWING_DATA,
+    config.STATE_SELECTING_TEMPLATE,
+    config.STATE_GENERATING_PDF,
+)
+_STATE_INDEX = {state: index for index, state in enumerate(STATES)}
+
+_SCALARS = (str, int, bool, type(None))
+_ENVELOPE_KEYS = ("state", "current_section_index", "cv_data")
+
+
+def _is_json_native(obj: Any) -> bool:
+    """
+    Whether JSON gives `obj` back unchanged: exact dict (str keys), list, str, int, bool, None and finite
+    floats. Tuples, dates, subclasses and the like would come back as something else (or not at all).
+    """
+    kind = type(obj)
+    if kind in _SCALARS:
+        return True
+    if kind is float:
+        return math.isfinite(obj)
+    if kind is list:
+        return all(_is_json_native(item) for item in obj)
+    if kind is dict:
+        return all(type(key) is str and _is_json_native(value) for key, value in obj.items())
+    return False
+
+
+def _dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _loads(body: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def _envelope(user_data: Dict[Any, Any]) -> list:
+    """[version, state index, section index, cv_data, other keys]; absent values are null."""
+    extra = {key: value for key, value in user_data.items() if key not in _ENVELOPE_KEYS}
+    state = user_data.get("state")
+    return [
+        CODEC_VERSION,
+        _STATE_INDEX.get(state, state), # Unknown states are kept as strings
+        user_data.get("current_section_index"),
+        user_data.get("cv_data"),
+        extra or None,
+    ]
+
+
+def encode_user_data(user_data: Dict[Any, Any]) -> bytes:
+    """
+    Encodes a user's conversation state compactly: state as a small integer, everything as JSON
+    (cv_data is already a model_dump(mode='json') dict), compressed once large enough to benefit.
+    Falls back to pickle for anything JSON wouldn't give back unchanged, so decoding always returns
+    what was encoded.
+    """
+    # The envelope stores absent and None alike for its own keys.
+    if not _is_json_native(user_data) or any(key in user_data and user_data[key] is None for key in _ENVELOPE_KEYS):
+        return pickle.dumps(user_data, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        body = _dumps(_envelope(user_data))
+    except (TypeError, ValueError): # E.g. integers beyond 64 bits for orjson
+        return pickle.dumps(user_data, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(body) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(body, COMPRESSION_LEVEL)
+        if len(compressed) < len(body):
+            return bytes((FORMAT_JSON_ZLIB,)) + compressed
+    return bytes((FORMAT_JSON,)) + body
+
+
+def decode_user_data(payload: bytes) -> Dict[Any, Any]:
+    """Inverse of encode_user_data. Raises ValueError for unknown formats or versions."""
+    kind = payload[0]
+    if kind == FORMAT_PICKLE:
+        return pickle.loads(payload)
+    if kind == FORMAT_JSON_ZLIB:
+        body = zlib.decompress(payload[1:])
+    elif kind == FORMAT_JSON:
+        body = payload[1:]
+    else:
+        raise ValueError(f"Unknown state format {kind:#x}")
+
+    envelope = _loads(body)
+    if envelope[0] != CODEC_VERSION:
+        raise ValueError(f"Unsupported state codec version {envelope[0]}")
+    _, state, section_index, cv_data, extra = envelope
+    user_data = dict(extra or {})
+    if state is not None:
+        user_data["state"] = STATES[state] if isinstance(state, int) else state
+    if section_index is not None:
+        user_data["current_section_index"] = section_index
+    if cv_data is not None:
+        user_data["cv_data"] = cv_data
+    return user_data
@@ -0,0 +1,9 @@
+import os
+import sys
+from pathlib import Path
+
+# config refuses to import without these; tests never reach Telegram or Gemini.
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,57 @@
+import os
+import time
+
+import cache
+from cache import DiskCache, MemoryCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    memory = MemoryCache(max_bytes=10)
+    memory.set("a", b"12345")
+    memory.set("b", b"12345")
+    memory.get("a")
+    memory.set("c", b"12345")
+
+    assert memory.get("b") is None
+    assert memory.get("a") == b"12345"
+    assert memory.size_bytes == 10
+
+
+def test_disk_cache_sweep_deletes_expired_files_never_read_again(tmp_path):
+    disk = DiskCache(tmp_path, ttl=60)
+    disk._set("old", b"x" * 10)
+    disk._set("other", b"y")
+    an_hour_ago = time.time() - 3600
+    os.utime(tmp_path / "old", (an_hour_ago, an_hour_ago))
+    (tmp_path / "subcache").mkdir()
+
+    disk._next_sweep = 0
+    disk._set("new", b"z")
+
+    assert sorted(os.listdir(tmp_path)) == ["new", "other", "subcache"]
+    assert disk._size == 2
+
+
+def test_disk_cache_sweeps_only_every_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "DISK_SWEEP_INTERVAL", 3600)
+    disk = DiskCache(tmp_path, ttl=60)
+    disk._set("old", b"x")
+    an_hour_ago = time.time() - 3600
+    os.utime(tmp_path / "old", (an_hour_ago, an_hour_ago))
+
+    disk._set("new", b"z")
+
+    assert (tmp_path / "old").exists()
+
+
+def test_disk_cache_over_budget_deletes_oldest_files(tmp_path):
+    disk = DiskCache(tmp_path, max_bytes=25)
+    for age, key in enumerate(["c", "b", "a"]):
+        disk._set(key, b"x" * 10)
+        stamp = time.time() - 100 * (3 - age)
+        os.utime(tmp_path / key, (stamp, stamp))
+
+    disk._set("d", b"x" * 10)
+
+    assert sorted(os.listdir(tmp_path)) == ["a", "d"]
+    assert disk._size == 20
@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from gemini_client import CircuitBreaker, GeminiClient, GeminiUnavailable, TokenBucket
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def elapse_reset_timeout(breaker: CircuitBreaker):
+    breaker._opened_at -= breaker.reset_timeout
+
+
+# --- CircuitBreaker ---
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success() # Resets the count
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call()
+
+
+def test_breaker_lets_one_trial_through_when_half_open():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    elapse_reset_timeout(breaker)
+
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+    with pytest.raises(GeminiUnavailable):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_failed_trial_opens_the_circuit_again():
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=30)
+    open_breaker(breaker)
+    elapse_reset_timeout(breaker)
+
+    breaker.record_failure(breaker.before_call())
+    assert breaker.state == "open"
+    elapse_reset_timeout(breaker)
+    assert breaker.before_call() is True # A new trial once the timeout passed again
+
+
+def test_failure_of_a_non_trial_call_does_not_end_the_trial():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    open_breaker(breaker)
+    elapse_reset_timeout(breaker)
+    assert breaker.before_call() is True
+
+    breaker.record_failure(trial=False) # A call started before the circuit opened fails late
+    elapse_reset_timeout(breaker)
+    with pytest.raises(GeminiUnavailable): # Still only one trial in flight
+        breaker.before_call()
+
+
+# --- TokenBucket ---
+
+def test_token_bucket_allows_a_burst_then_limits_the_rate():
+    async def main():
+        bucket = TokenBucket(rate=20, capacity=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - started
+        for _ in range(2):
+            await bucket.acquire()
+        return burst, time.monotonic() - started
+
+    burst, total = asyncio.run(main())
+    assert burst < 0.02
+    assert 0.09 <= total < 0.3 # Two more tokens at 20 per second
+
+
+# --- Retry policy ---
+
+def make_client(call, **kwargs) -> GeminiClient:
+    options = dict(max_retries=2, retry_base_delay=0.001, retry_max_delay=0.01, breaker_failures=10)
+    options.update(kwargs)
+    return GeminiClient(call, **options)
+
+
+def test_transient_errors_are_retried():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        if len(calls) < 3:
+            raise google_exceptions.ServiceUnavailable("overloaded")
+        return "ok"
+
+    client = make_client(call)
+    assert asyncio.run(client.generate()) == "ok"
+    assert len(calls) == 3
+    assert client.breaker.state == "closed"
+
+
+def test_retries_give_up_with_gemini_unavailable():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise google_exceptions.TooManyRequests("slow down")
+
+    with pytest.raises(GeminiUnavailable):
+        asyncio.run(make_client(call).generate())
+    assert len(calls) == 3
+
+
+def test_other_errors_are_raised_unchanged_without_retry():
+    calls = []
+
+    async def call():
+        calls.append(1)
+        raise google_exceptions.InvalidArgument("bad prompt")
+
+    client = make_client(call, breaker_failures=1)
+    with pytest.raises(google_exceptions.InvalidArgument):
+        asyncio.run(client.generate())
+    assert len(calls) == 1
+    assert client.breaker.state == "closed"
+
+
+def test_backoff_is_capped_full_jitter():
+    client = make_client(None, retry_base_delay=1, retry_max_delay=5)
+    for attempt in range(6):
+        assert 0 <= client._backoff(attempt) <= min(5, 2 ** attempt)
+
+
+def test_concurrent_failure_does_not_release_the_half_open_trial():
+    async def main():
+        finish_trial = asyncio.Event()
+
+        async def call():
+            await finish_trial.wait()
+            return "ok"
+
+        client = make_client(call, max_retries=0, breaker_failures=1)
+        open_breaker(client.breaker)
+        elapse_reset_timeout(client.breaker)
+
+        trial = asyncio.create_task(client.generate())
+        while not client.breaker._trial_running:
+            await asyncio.sleep(0)
+        client.breaker.record_failure() # E.g. a call that started before the circuit opened fails late
+        with pytest.raises(GeminiUnavailable): # Rejected: the trial is still running
+            await client.generate()
+        finish_trial.set()
+        assert await asyncio.wait_for(trial, 1) == "ok"
+        assert client.breaker.state == "closed"
+
+    asyncio.run(main())
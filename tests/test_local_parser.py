@@ -0,0 +1,101 @@
+import pytest
+
+import config
+import local_parser
+
+STRUCTURED_CV = """Jane Doe
+jane.doe@example.com | +44 20 7946 0958
+Summary
+Backend engineer building payment systems.
+Experience
+Senior Engineer at Acme Corp (2020 - Present)
+London
+- Led the payments platform
+- Cut settlement time by half
+Education
+BSc Computer Science from University of Leeds (2016)
+Skills
+Languages: Python, Go
+Tools: Docker, Kubernetes
+"""
+
+
+def test_structured_cv_is_parsed_with_full_confidence():
+    cv_data, confidence = local_parser.parse_cv_text(STRUCTURED_CV)
+
+    assert confidence == 1.0
+    assert cv_data.contact_info.full_name == "Jane Doe"
+    assert cv_data.work_experience[0].company == "Acme Corp"
+    assert cv_data.work_experience[0].location == "London"
+    assert [skill.category for skill in cv_data.skills] == ["Languages", "Tools"]
+
+
+def test_free_text_is_not_parsed():
+    assert local_parser.parse_cv_text("I have worked on many things over the years.") == (None, 0.0)
+
+
+def test_unknown_sections_lower_confidence():
+    cv_text = """Jane Doe
+jane.doe@example.com
+Education
+BSc Computer Science from University of Leeds (2016)
+Skills: Python, SQL
+Publications
+Deep Learning for Widgets
+Volunteering
+Red Cross driver 2018-2020
+"""
+    _, confidence = local_parser.parse_cv_text(cv_text)
+    assert confidence < config.LOCAL_PARSE_MIN_CONFIDENCE
+
+
+def test_unknown_sections_stay_out_of_skills():
+    cv_text = """Jane Doe
+jane.doe@example.com
+Education
+BSc Computer Science from University of Leeds (2016)
+Skills
+Python, SQL
+Publications
+Deep Learning for Widgets
+Volunteering
+Red Cross driver 2018-2020
+"""
+    cv_data, confidence = local_parser.parse_cv_text(cv_text)
+
+    assert confidence < config.LOCAL_PARSE_MIN_CONFIDENCE
+    skills = [skill for item in cv_data.skills for skill in item.skills_list]
+    assert sorted(skills) == ["Python", "SQL"]
+
+
+def test_prose_in_skills_section_is_not_counted():
+    cv_text = STRUCTURED_CV + "I am also keen on learning new things, and enjoy working in teams of all sizes\n"
+    _, confidence = local_parser.parse_cv_text(cv_text)
+    assert confidence < 1.0
+
+
+def test_only_first_summary_paragraph_counts():
+    cv_text = STRUCTURED_CV.replace(
+        "Backend engineer building payment systems.\n",
+        "Backend engineer building payment systems.\nReferences available on request\nHobbies: chess\n",
+    )
+    cv_data, confidence = local_parser.parse_cv_text(cv_text)
+
+    assert cv_data.summary == "Backend engineer building payment systems."
+    assert confidence < 1.0
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("Languages: Python, Go", True),
+    ("Python, SQL, Docker", True),
+    ("Python", False),
+    ("Red Cross driver 2018-2020", False),
+    ("I enjoy working with people from many different backgrounds, and learning", False),
+])
+def test_skills_lines(line, expected):
+    assert local_parser._is_skills_line(line) is expected
+
+
+def test_local_parser_is_opt_in(monkeypatch):
+    monkeypatch.setattr(config, "LOCAL_PARSER", False)
+    assert local_parser.try_parse_cv_text(STRUCTURED_CV) is None
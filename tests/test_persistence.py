@@ -0,0 +1,200 @@
+import asyncio
+
+import pytest
+
+import config
+import persistence
+from persistence import RedisPersistence
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def set(self, key, value, ex=None):
+        self.commands.append(("set", key, value, ex))
+
+    def delete(self, key):
+        self.commands.append(("delete", key))
+
+    async def execute(self):
+        self.client.executes += 1
+        if self.client.failures:
+            self.client.failures -= 1
+            raise ConnectionError("Redis is down")
+        for command in self.commands:
+            if command[0] == "set":
+                self.client.store[command[1]] = command[2]
+                self.client.ttls[command[1]] = command[3]
+            else:
+                self.client.store.pop(command[1], None)
+
+
+class FakeRedis:
+    """The subset of redis.asyncio.Redis used by RedisPersistence for user data."""
+
+    def __init__(self):
+        self.store = {}
+        self.ttls = {}
+        self.executes = 0
+        self.failures = 0 # Number of upcoming pipeline executions that fail
+        self.closed = False
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def aclose(self):
+        self.closed = True
+
+
+STATE = {"state": config.STATE_REVIEWING_DATA, "cv_data": {"summary": "Engineer"}}
+KEY = "test:user:1"
+
+
+def make_persistence(client, **kwargs) -> RedisPersistence:
+    return RedisPersistence(client, prefix="test", ttl=3600, **kwargs)
+
+
+async def settle(store: RedisPersistence):
+    if store._write_task is not None:
+        await store._write_task
+
+
+async def wait_for_executes(client: FakeRedis, count: int):
+    while client.executes < count:
+        await asyncio.sleep(0.005)
+
+
+def test_state_round_trips_through_redis():
+    async def main():
+        client = FakeRedis()
+        store = make_persistence(client, state_ttls={config.STATE_REVIEWING_DATA: 600})
+        await store.update_user_data(1, STATE)
+        await settle(store)
+        assert client.ttls[KEY] == 600
+
+        user_data = {"current_section_index": 3}
+        await make_persistence(client).refresh_user_data(1, user_data)
+        assert user_data == {**STATE, "current_section_index": 3}
+
+    asyncio.run(main())
+
+
+def test_updates_are_batched_and_unchanged_states_skipped():
+    async def main():
+        client = FakeRedis()
+        store = make_persistence(client)
+        for user_id in range(5):
+            await store.update_user_data(user_id, {**STATE, "n": user_id})
+        await settle(store)
+        assert client.executes == 1
+
+        for user_id in range(5):
+            await store.update_user_data(user_id, {**STATE, "n": user_id})
+        await settle(store)
+        assert client.executes == 1
+
+    asyncio.run(main())
+
+
+def test_empty_state_deletes_the_key():
+    async def main():
+        client = FakeRedis()
+        store = make_persistence(client)
+        await store.update_user_data(1, STATE)
+        await settle(store)
+        await store.drop_user_data(1)
+        await settle(store)
+        assert KEY not in client.store
+
+    asyncio.run(main())
+
+
+def test_eviction_rewrites_an_unchanged_state_whose_key_expired():
+    async def main():
+        client = FakeRedis()
+        store = make_persistence(client)
+        await store.update_user_data(1, STATE)
+        await settle(store)
+        client.store.clear() # The key expired while the session was resident
+
+        assert await store.evict_user_data(1, STATE)
+        assert KEY in client.store
+
+    asyncio.run(main())
+
+
+def test_eviction_fails_while_redis_is_down():
+    async def main():
+        client = FakeRedis()
+        client.failures = 1
+        store = make_persistence(client)
+        assert not await store.evict_user_data(1, STATE)
+        store._retry.cancel()
+
+    asyncio.run(main())
+
+
+def test_failed_write_is_retried_with_backoff(monkeypatch):
+    monkeypatch.setattr(persistence, "RETRY_MIN_DELAY", 0.01)
+
+    async def main():
+        client = FakeRedis()
+        client.failures = 2
+        store = make_persistence(client)
+        await store.update_user_data(1, STATE)
+        await settle(store)
+        assert store._retry_delay == 0.01
+
+        await asyncio.wait_for(wait_for_executes(client, 2), 1) # First retry fails too
+        await settle(store)
+        assert store._retry_delay == 0.02
+        assert KEY not in client.store
+
+        await asyncio.wait_for(wait_for_executes(client, 3), 1)
+        await settle(store)
+        assert client.store[KEY]
+        assert client.executes == 3
+        assert store._retry is None and store._retry_delay == 0
+
+    asyncio.run(main())
+
+
+def test_flush_writes_pending_states_and_closes_the_client(monkeypatch):
+    monkeypatch.setattr(persistence, "RETRY_MIN_DELAY", 60)
+
+    async def main():
+        client = FakeRedis()
+        client.failures = 1
+        store = make_persistence(client)
+        await store.update_user_data(1, STATE)
+        await settle(store)
+        await store.flush() # Doesn't wait for the scheduled retry
+
+        assert KEY in client.store
+        assert client.closed
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("payload", [None, b"\x07garbage"])
+def test_missing_or_unreadable_state_leaves_user_data_alone(payload):
+    async def main():
+        client = FakeRedis()
+        if payload is not None:
+            client.store[KEY] = payload
+        user_data = {"state": config.STATE_START}
+        await make_persistence(client).refresh_user_data(1, user_data)
+        assert user_data == {"state": config.STATE_START}
+
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from gemini_service import MalformedResponseError, SectionStreamParser
+
+RESPONSE = {
+    "contact_info": {"full_name": "Jane Doe", "email": "jane@example.com"},
+    "summary": "Likes {braces}, [brackets] and \"quotes\", too.",
+    "skills": [{"category": "Languages", "skills_list": ["Python", "Go"]}],
+    "awards": None,
+}
+
+
+def feed_in_chunks(text: str, size: int) -> list:
+    parser = SectionStreamParser()
+    members = []
+    for start in range(0, len(text), size):
+        members.extend(parser.feed(text[start:start + size]))
+    assert parser.finished
+    return members
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, 10_000])
+def test_members_are_returned_whatever_the_chunking(size):
+    assert feed_in_chunks(json.dumps(RESPONSE, indent=2), size) == list(RESPONSE.items())
+
+
+def test_member_is_returned_as_soon_as_it_is_complete():
+    parser = SectionStreamParser()
+    assert parser.feed('{"summary": "Hi", "skills": [{"category": "A", ') == [("summary", "Hi")]
+    assert parser.feed('"skills_list": []}]}') == [("skills", [{"category": "A", "skills_list": []}])]
+    assert parser.finished
+
+
+def test_json_fence_is_tolerated():
+    assert feed_in_chunks('```json\n{"summary": "Hi"}\n```', 4) == [("summary", "Hi")]
+
+
+def test_empty_object():
+    assert feed_in_chunks("{}", 1) == []
+
+
+def test_text_before_the_object_is_rejected():
+    with pytest.raises(MalformedResponseError):
+        SectionStreamParser().feed('Sure! {"summary": "Hi"}')
+
+
+def test_invalid_member_is_rejected():
+    with pytest.raises(MalformedResponseError):
+        SectionStreamParser().feed('{"summary": Hi, "skills": []}')
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def main():
+        flights = SingleFlight("test")
+        return await asyncio.gather(*(flights.run("key", work, 21) for _ in range(3)))
+
+    assert asyncio.run(main()) == [42, 42, 42]
+    assert calls == [21]
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        flights = SingleFlight("test")
+        first = asyncio.create_task(flights.run("key", asyncio.sleep, 0.02, "done"))
+        second = asyncio.create_task(flights.run("key", asyncio.sleep, 0.02, "done"))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_caller_arriving_right_after_the_last_one_was_cancelled_starts_fresh():
+    async def work():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.01) # Unwinding takes a while, e.g. killing a worker
+            raise
+        return "stale"
+
+    async def main():
+        flights = SingleFlight("test")
+        only = asyncio.create_task(flights.run("key", work))
+        await asyncio.sleep(0)
+        only.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await only
+        return await flights.run("key", asyncio.sleep, 0, "fresh")
+
+    assert asyncio.run(main()) == "fresh"
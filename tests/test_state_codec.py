@@ -0,0 +1,75 @@
+import datetime
+import pickle
+
+import pytest
+
+import config
+import state_codec
+
+CV_DATA = {
+    "contact_info": {"full_name": "Jane Doe", "email": "jane.doe@example.com"},
+    "summary": "Backend engineer. " * 40,
+    "work_experience": [{"job_title": "Engineer", "company": "Acme Corp", "description": ["Built things"]}],
+    "skills": [{"category": "Languages", "skills_list": ["Python", "Go"]}],
+}
+
+SESSIONS = [
+    {"state": config.STATE_REVIEWING_DATA, "cv_data": CV_DATA},
+    {"state": config.STATE_SCRATCH_AWAIT_DATA, "cv_data": {"summary": None, "skills": []}, "current_section_index": 2},
+    {"state": "SOME_FUTURE_STATE", "ratio": 0.5, "flag": True, "note": "ünïcode"},
+]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(state_codec, "orjson", None)
+    elif state_codec.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+@pytest.mark.parametrize("user_data", SESSIONS)
+def test_json_round_trip(backend, user_data):
+    payload = state_codec.encode_user_data(user_data)
+
+    assert payload[0] in (state_codec.FORMAT_JSON, state_codec.FORMAT_JSON_ZLIB)
+    assert state_codec.decode_user_data(payload) == user_data
+
+
+def test_large_state_is_compressed(backend):
+    assert state_codec.encode_user_data(SESSIONS[0])[0] == state_codec.FORMAT_JSON_ZLIB
+
+
+@pytest.mark.parametrize("user_data", [
+    {"state": config.STATE_START, "pending": (1, 2)},
+    {"state": config.STATE_START, "since": datetime.date(2024, 1, 31)},
+    {"state": config.STATE_START, "cv_data": {"counts": {1: 2}}},
+    {1: "int key"},
+    {"state": config.STATE_START, "score": float("nan")},
+    {"state": None, "other": 1},
+])
+def test_values_json_would_change_fall_back_to_pickle(backend, user_data):
+    payload = state_codec.encode_user_data(user_data)
+
+    assert payload[0] == state_codec.FORMAT_PICKLE
+    decoded = state_codec.decode_user_data(payload)
+    assert decoded.keys() == user_data.keys()
+    assert repr(decoded) == repr(user_data) # NaN != NaN
+
+
+def test_integers_beyond_64_bits_survive(backend):
+    user_data = {"huge": 2 ** 70}
+    assert state_codec.decode_user_data(state_codec.encode_user_data(user_data)) == user_data
+
+
+def test_pickled_states_from_before_the_codec_are_read():
+    user_data = {"state": config.STATE_START}
+    assert state_codec.decode_user_data(pickle.dumps(user_data, protocol=2)) == user_data
+
+
+def test_unknown_format_and_version_are_rejected():
+    with pytest.raises(ValueError):
+        state_codec.decode_user_data(b"\x07{}")
+    with pytest.raises(ValueError):
+        state_codec.decode_user_data(b"\x01[99,null,null,null,null]")
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timezone
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, first_name="Test", is_bot=False)
+    message = Message(message_id=update_id, date=datetime.now(timezone.utc), chat=Chat(id=user_id, type=Chat.PRIVATE),
+                      from_user=user, text="tap")
+    return Update(update_id=update_id, message=message)
+
+
+async def process(processor: PerUserUpdateProcessor, updates: list[tuple[int, int, float]], log: list):
+    async def handle(update_id: int, user_id: int, duration: float):
+        log.append(("start", update_id, user_id))
+        await asyncio.sleep(duration)
+        log.append(("end", update_id, user_id))
+
+    await processor.initialize()
+    tasks = []
+    for update_id, user_id, duration in updates:
+        tasks.append(asyncio.create_task(
+            processor.process_update(make_update(update_id, user_id), handle(update_id, user_id, duration))))
+        await asyncio.sleep(0) # Arrival order
+    await asyncio.gather(*tasks)
+    await processor.shutdown()
+
+
+def test_each_users_updates_run_one_at_a_time_in_order():
+    log = []
+    # User 1's first update is the slowest, so later ones would overtake it if they were not queued.
+    updates = [(0, 1, 0.05), (1, 2, 0.01), (2, 1, 0.0), (3, 1, 0.01), (4, 2, 0.0)]
+    asyncio.run(process(PerUserUpdateProcessor(8, 64), updates, log))
+
+    for user_id in (1, 2):
+        events = [(kind, update_id) for kind, update_id, user in log if user == user_id]
+        expected = [(kind, update_id) for update_id, user, _ in updates if user == user_id for kind in ("start", "end")]
+        assert events == expected
+
+
+def test_other_users_do_not_wait_for_a_slow_one():
+    log = []
+    asyncio.run(process(PerUserUpdateProcessor(8, 64), [(0, 1, 0.05), (1, 2, 0.0)], log))
+    assert log.index(("end", 1, 2)) < log.index(("end", 0, 1))
+
+
+def test_running_updates_are_capped():
+    running = peak = 0
+
+    async def handle():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    async def main():
+        processor = PerUserUpdateProcessor(2, 64)
+        await processor.initialize()
+        await asyncio.gather(*(processor.process_update(make_update(i, i), handle()) for i in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+
+
+def test_queues_are_removed_once_idle():
+    processor = PerUserUpdateProcessor(4, 16)
+    asyncio.run(process(processor, [(0, 1, 0.0), (1, 1, 0.0)], []))
+    assert not processor.is_busy(1)
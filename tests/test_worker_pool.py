@@ -0,0 +1,87 @@
+import asyncio
+import os
+import time
+
+import worker_pool
+from worker_pool import WorkerPool
+
+
+async def submit_tracked(pool: WorkerPool, started: asyncio.Event, *args):
+    worker_pool.job_started.set(started)
+    return await pool.submit(*args)
+
+
+def test_cancelling_a_queued_job_keeps_the_worker():
+    async def main():
+        pool = WorkerPool("test", processes=1, max_queue=4, job_timeout=10)
+        pool.start()
+        try:
+            pid = await pool.submit(os.getpid)
+            running = asyncio.create_task(pool.submit(time.sleep, 0.3))
+            started = asyncio.Event()
+            queued = asyncio.create_task(submit_tracked(pool, started, os.getpid))
+            await asyncio.sleep(0.1)
+            assert not started.is_set()
+
+            queued.cancel()
+            await running
+            assert await pool.submit(os.getpid) == pid # Not killed and respawned
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())
+
+
+def test_job_started_is_set_once_the_job_has_a_worker():
+    async def main():
+        pool = WorkerPool("test", processes=1, max_queue=4, job_timeout=10)
+        pool.start()
+        try:
+            started = asyncio.Event()
+            await submit_tracked(pool, started, os.getpid)
+            assert started.is_set()
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())
+
+
+def test_idle_recycled_worker_is_stopped_once_its_replacement_is_ready():
+    async def main():
+        pool = WorkerPool("test", processes=1, max_queue=4, job_timeout=10, max_jobs_per_worker=1)
+        pool.start()
+        try:
+            await pool.submit(os.getpid)
+            retired = pool._workers[0]
+            assert retired.retiring
+            for _ in range(100): # No further jobs: the pool must retire it by itself
+                if not retired.process.is_alive():
+                    break
+                await asyncio.sleep(0.05)
+            assert not retired.process.is_alive()
+            assert pool._workers != [retired] and len(pool._workers) == 1
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())
+
+
+def test_busy_recycled_worker_finishes_its_job_first():
+    async def main():
+        pool = WorkerPool("test", processes=1, max_queue=4, job_timeout=10, max_jobs_per_worker=2)
+        pool.start()
+        try:
+            await pool.submit(os.getpid)
+            await pool.submit(os.getpid) # Recycle: the replacement starts warming up
+            retired = pool._workers[0]
+            # Racing the replacement's warm-up; either way the job must complete on a live worker
+            assert await pool.submit(time.sleep, 0.5) is None
+            for _ in range(100):
+                if not retired.process.is_alive():
+                    break
+                await asyncio.sleep(0.05)
+            assert not retired.process.is_alive()
+        finally:
+            pool.shutdown()
+
+    asyncio.run(main())
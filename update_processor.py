@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _UserQueue:
+    def __init__(self):
+        self.lock = asyncio.Lock() # FIFO: waiters acquire in arrival order
+        self.waiters = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different users concurrently while keeping each user's updates strictly
+    in arrival order, since the conversation state in user_data assumes one update at a time.
+
+    At most `max_concurrent_updates` updates run at once. PTB's own semaphore (sized
+    `max_pending_updates`) bounds updates accepted but still waiting for their user or a free slot,
+    so a user sending many updates queues behind themselves without holding a running slot.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int):
+        super().__init__(max(max_pending_updates, max_concurrent_updates))
+        self.max_running_updates = max_concurrent_updates
+        self._running: Optional[asyncio.BoundedSemaphore] = None
+        self._queues: dict[int, _UserQueue] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None # Not tied to a user: no ordering needed
+
+    def is_busy(self, user_id: int) -> bool:
+        """Whether an update of this user is running or waiting."""
+        return user_id in self._queues
+
+    async def initialize(self) -> None:
+        self._running = asyncio.BoundedSemaphore(self.max_running_updates)
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def _run(self, coroutine: Awaitable[Any], queued_at: float):
+        async with self._running:
+            metrics.observe("update_wait_seconds", time.perf_counter() - queued_at)
+            await coroutine
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        queued_at = time.perf_counter()
+        key = self._ordering_key(update)
+        if key is None:
+            await self._run(coroutine, queued_at)
+            return
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _UserQueue()
+        queue.waiters += 1
+        try:
+            async with queue.lock:
+                await self._run(coroutine, queued_at)
+        finally:
+            queue.waiters -= 1
+            if queue.waiters == 0:
+                del self._queues[key]
@@ -1,11 +1,11 @@
 import logging
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
+from telegram import Bot, Document, InlineKeyboardMarkup, InlineKeyboardButton, Update
 from telegram.ext import ContextTypes
-from PyPDF2 import PdfReader
-from docx import Document
 import io
+import httpx
 
 from config import TEMPLATES
+from extraction_service import SharedUpload
 
 logger = logging.getLogger(__name__)
 
@@ -27,38 +27,48 @@ def create_confirmation_keyboard(callback_prefix: str) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def create_template_selection_keyboard() -> InlineKeyboardMarkup:
-    """Creates keyboard for selecting a CV template."""
+def create_template_selection_keyboard(with_preview: bool = False) -> InlineKeyboardMarkup:
+    """Creates keyboard for selecting a CV template, optionally with a button to preview all templates."""
     keyboard = [
         [InlineKeyboardButton(f"{idx+1}. {details['name']}", callback_data=f"select_template_{key}")]
         for idx, (key, details) in enumerate(TEMPLATES.items())
     ]
+    if with_preview:
+        keyboard.append([InlineKeyboardButton("👀 Preview all templates", callback_data="preview_templates")])
     return InlineKeyboardMarkup(keyboard)
 
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """Extracts text from PDF file content."""
-    text = ""
-    try:
-        reader = PdfReader(io.BytesIO(file_content))
-        for page in reader.pages:
-            text += page.extract_text() or ""
-    except Exception as e:
-        logger.error(f"Error reading PDF: {e}", exc_info=True)
-        return ""
-    return text
-
-def extract_text_from_docx(file_content: bytes) -> str:
-    """Extracts text from DOCX file content."""
-    text = ""
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+DOWNLOAD_TIMEOUT = 60 # Seconds
+
+
+async def _stream_download(url: str, upload: SharedUpload):
+    # PTB's download_to_memory fetches the whole body as bytes before writing it, so stream it ourselves.
+    async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT) as client:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                upload.write(chunk) # ValueError if the file is larger than announced
+
+async def download_document(bot: Bot, document: Document) -> SharedUpload:
+    """
+    Downloads a Telegram document into a shared memory buffer sized from its file_size, streaming
+    it in chunks so no full copy of the file is held outside that buffer. The caller must close() the result.
+    """
+    file = await bot.get_file(document.file_id)
+    capacity = document.file_size or file.file_size
+    if not capacity or bot.local_mode: # Size unknown or a local file: load it, then copy once
+        buffer = io.BytesIO()
+        await file.download_to_memory(buffer)
+        return SharedUpload.from_bytes(buffer.getbuffer())
+
+    upload = SharedUpload(capacity)
     try:
-        document = Document(io.BytesIO(file_content))
-        for para in document.paragraphs:
-            text += para.text + "\n"
-    except Exception as e:
-        logger.error(f"Error reading DOCX: {e}", exc_info=True)
-        return ""
-    return text
+        await _stream_download(file.file_path, upload)
+    except Exception:
+        upload.close()
+        raise
+    return upload
 
 async def cleanup_user_data(context: ContextTypes.DEFAULT_TYPE):
     """Clears user-specific data from context after completion or cancellation."""
@@ -72,6 +82,10 @@ async def cleanup_user_data(context: ContextTypes.DEFAULT_TYPE):
     except AttributeError:
          pass # May not always be available depending on context source
 
+    if isinstance(user_id, int):
+        import speculation # Lazy: pulls in the PDF renderer
+        speculation.cancel(user_id)
+
     # Create a copy of keys to avoid modifying dict during iteration
     for key in list(user_data.keys()):
         if key in keys_to_clear:
@@ -0,0 +1,321 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESPAWN_DELAY = 5 # Seconds to wait before replacing a worker that died during start-up
+
+# Set by submit() once a job leaves the queue, if the caller's context holds an event here. Until then,
+# cancelling the job is free; afterwards it kills the worker running it.
+job_started: ContextVar[Optional[asyncio.Event]] = ContextVar("job_started", default=None)
+
+
+class WorkerPoolError(Exception):
+    """Base error for jobs submitted to a WorkerPool."""
+
+class WorkerPoolBusy(WorkerPoolError):
+    """Raised when the pool's queue is full and the job was rejected."""
+
+class WorkerJobTimeout(WorkerPoolError):
+    """Raised when a job exceeds its deadline (its worker is killed)."""
+
+class WorkerJobFailed(WorkerPoolError):
+    """Raised when the job raised inside the worker process."""
+
+
+def _current_rss() -> int:
+    """Resident set size of this process in bytes (peak RSS where the current value isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # KiB on Linux
+    except ImportError: # Windows
+        return 0
+
+
+def _worker_main(conn, initializer: Optional[Callable[[], None]]):
+    """Entry point of a worker process: runs jobs received over the pipe until told to stop."""
+    if initializer:
+        initializer()
+    conn.send(("ready", None, _current_rss()))
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None: # Stop sentinel
+            break
+        func, args, kwargs = job
+        try:
+            conn.send(("ok", func(*args, **kwargs), _current_rss()))
+        except Exception:
+            conn.send(("error", traceback.format_exc(), _current_rss()))
+    conn.close()
+
+
+class _Worker:
+    """A single worker process and the parent's end of its pipe."""
+
+    def __init__(self, ctx, initializer: Optional[Callable[[], None]], name: str):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, initializer), name=name, daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.name = name
+        self.jobs_done = 0
+        self.rss = 0
+        self.retiring = False # A replacement is warming up
+        self.replaced = False # The replacement is ready; stop this worker as soon as its job is done
+
+    def wait_ready(self) -> int:
+        """Blocks until the worker finished its initializer; returns its RSS. Runs in a helper thread."""
+        status, _, rss = self.conn.recv()
+        return rss
+
+    def run_job(self, job: tuple, timeout: Optional[float]) -> tuple:
+        """Sends a job and blocks until its result arrives. Runs in a helper thread."""
+        self.conn.send(job)
+        if not self.conn.poll(timeout):
+            raise WorkerJobTimeout(f"Job exceeded {timeout}s on {self.name}")
+        return self.conn.recv()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def stop(self, grace: float = 5.0):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=grace)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of worker processes for CPU-heavy jobs (PDF rendering, text extraction).
+
+    Jobs are awaited from the event loop without blocking it. The number of jobs waiting
+    for a free worker is bounded by `max_queue`; each job has a deadline after which its
+    worker is killed and replaced, and cancelling the awaiting task kills the worker too,
+    so abandoned work never keeps a CPU busy. With `processes=0` jobs run in threads of
+    the current process instead (useful for debugging; deadlines can't interrupt them).
+
+    Workers are recycled after `max_jobs_per_worker` jobs or once their RSS exceeds
+    `max_rss_bytes` (0 disables either limit). A recycled worker keeps serving until its
+    replacement has finished its initializer, so warm-up never lands on a user's job.
+    """
+
+    def __init__(self, name: str, processes: int, max_queue: int, job_timeout: Optional[float],
+                 initializer: Optional[Callable[[], None]] = None,
+                 max_jobs_per_worker: int = 0, max_rss_bytes: int = 0):
+        self.name = name
+        self.processes = max(0, processes)
+        self.max_queue = max(0, max_queue)
+        self.job_timeout = job_timeout
+        self.initializer = initializer
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_bytes = max_rss_bytes
+        self._ctx = multiprocessing.get_context("spawn") # Never fork the bot's threads/event loop
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: list[_Worker] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._spawned = 0
+        self._started = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    @property
+    def pending(self) -> int:
+        """Jobs currently running or waiting for a worker."""
+        return self._pending
+
+    @property
+    def free_slots(self) -> int:
+        """Jobs that can still be submitted before the pool reports itself busy."""
+        return max(0, self.processes + self.max_queue - self._pending)
+
+    def start(self):
+        """Starts the worker processes. Must be called from the running event loop."""
+        if self._started:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.processes), thread_name_prefix=f"{self.name}-io")
+        self._idle = asyncio.Queue()
+        self._started = True
+        if self.processes == 0 and self.initializer:
+            self.initializer()
+        for _ in range(self.processes):
+            self._spawn()
+        logger.info(f"Worker pool '{self.name}' started with {self.processes} process(es), queue limit {self.max_queue}")
+
+    def shutdown(self):
+        """Stops all workers. Jobs still running are killed."""
+        if not self._started:
+            return
+        self._started = False
+        for worker in self._workers:
+            worker.stop()
+            metrics.remove_gauge("worker_rss_bytes", pool=self.name, worker=worker.name)
+        self._workers.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Worker pool '{self.name}' stopped")
+
+    def _spawn(self, replacing: Optional[_Worker] = None):
+        """Starts a worker process; it joins the idle queue once its initializer has run."""
+        self._spawned += 1
+        worker = _Worker(self._ctx, self.initializer, f"{self.name}-{self._spawned}")
+        self._workers.append(worker)
+        # Warm-up can take seconds, so wait for it on the loop's default executor, not the job threads.
+        ready = asyncio.get_running_loop().run_in_executor(None, worker.wait_ready)
+        ready.add_done_callback(lambda fut: self._on_ready(worker, fut, replacing))
+
+    def _on_ready(self, worker: _Worker, ready: asyncio.Future, replacing: Optional[_Worker]):
+        if not self._started:
+            return
+        if ready.cancelled() or ready.exception() is not None:
+            logger.error(f"Worker {worker.name} died during start-up, respawning in {RESPAWN_DELAY}s")
+            self._discard(worker)
+            asyncio.get_running_loop().call_later(RESPAWN_DELAY, self._respawn, replacing)
+            return
+        worker.rss = ready.result()
+        metrics.set_gauge("worker_rss_bytes", worker.rss, pool=self.name, worker=worker.name)
+        self._idle.put_nowait(worker)
+        if replacing is not None:
+            if self._take_idle(replacing):
+                self._discard(replacing, graceful=True)
+            else:
+                replacing.replaced = True # Busy: _release stops it after its job
+
+    def _take_idle(self, worker: _Worker) -> bool:
+        """Removes `worker` from the idle queue; False if it isn't there (busy with a job)."""
+        found = False
+        others = []
+        while not self._idle.empty(): # Nobody waits on a non-empty queue, so this can't hand workers out
+            idle = self._idle.get_nowait()
+            if idle is worker:
+                found = True
+            else:
+                others.append(idle)
+        for idle in others:
+            self._idle.put_nowait(idle)
+        return found
+
+    def _respawn(self, replacing: Optional[_Worker]):
+        if self._started:
+            self._spawn(replacing)
+
+    def _discard(self, worker: _Worker, graceful: bool = False):
+        # Joining the process can take seconds; do it off the event loop.
+        stopped = asyncio.get_running_loop().run_in_executor(None, worker.stop if graceful else worker.kill)
+        stopped.add_done_callback(lambda fut: self._on_stopped(worker, fut))
+        if worker in self._workers:
+            self._workers.remove(worker)
+        metrics.remove_gauge("worker_rss_bytes", pool=self.name, worker=worker.name)
+
+    def _on_stopped(self, worker: _Worker, stopped: asyncio.Future):
+        if not stopped.cancelled() and stopped.exception() is not None:
+            logger.warning(f"Stopping worker {worker.name} failed: {stopped.exception()}")
+
+    def _replace(self, worker: _Worker):
+        """Kills a worker in an unknown state and starts a fresh one."""
+        self._discard(worker)
+        if self._started and not worker.retiring: # A retiring worker's replacement is already on its way
+            self._spawn()
+
+    def _recycle_reason(self, worker: _Worker) -> Optional[str]:
+        if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+            return "max_jobs"
+        if self.max_rss_bytes and worker.rss >= self.max_rss_bytes:
+            return "max_rss"
+        return None
+
+    def _release(self, worker: _Worker, future: asyncio.Future):
+        """Done-callback of a job's I/O future: returns the worker, recycles it or replaces it."""
+        if future.cancelled() or future.exception() is not None:
+            self._replace(worker)
+            return
+        if not self._started:
+            return
+
+        worker.jobs_done += 1
+        worker.rss = future.result()[2]
+        metrics.inc("worker_jobs_total", pool=self.name)
+        metrics.set_gauge("worker_rss_bytes", worker.rss, pool=self.name, worker=worker.name)
+
+        if worker.replaced:
+            self._discard(worker, graceful=True)
+            return
+        reason = self._recycle_reason(worker)
+        if reason and not worker.retiring:
+            logger.info(f"Recycling worker {worker.name} ({reason}: {worker.jobs_done} jobs, {worker.rss // (1024 * 1024)} MiB RSS)")
+            metrics.inc("worker_recycled_total", pool=self.name, reason=reason)
+            worker.retiring = True
+            self._spawn(replacing=worker)
+        self._idle.put_nowait(worker)
+
+    @staticmethod
+    def _mark_started():
+        started = job_started.get()
+        if started is not None:
+            started.set()
+
+    async def submit(self, func: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Runs `func(*args, **kwargs)` in a worker and returns its result.
+        `func` must be a picklable module-level function. Raises a WorkerPoolError subclass
+        if the queue is full, the job times out or the job itself raised.
+        """
+        if not self._started:
+            raise WorkerPoolError(f"Worker pool '{self.name}' is not running")
+        if self._pending >= self.processes + self.max_queue:
+            raise WorkerPoolBusy(f"Worker pool '{self.name}' is full ({self._pending} jobs pending)")
+
+        timeout = self.job_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        self._pending += 1
+        try:
+            if self.processes == 0:
+                self._mark_started()
+                try:
+                    return await asyncio.wait_for(loop.run_in_executor(self._executor, lambda: func(*args, **kwargs)), timeout)
+                except asyncio.TimeoutError:
+                    raise WorkerJobTimeout(f"Job exceeded {timeout}s in '{self.name}'")
+
+            worker = await self._idle.get()
+            self._mark_started()
+            io_future = loop.run_in_executor(self._executor, worker.run_job, (func, args, kwargs), timeout)
+            io_future.add_done_callback(lambda fut: self._release(worker, fut))
+            try:
+                status, payload, _ = await asyncio.shield(io_future)
+            except asyncio.CancelledError:
+                # Killing the process unblocks the helper thread; _release then reaps and respawns it off the loop.
+                worker.process.kill()
+                raise
+            except (EOFError, OSError) as e:
+                raise WorkerPoolError(f"Worker {worker.name} died while running a job: {e}")
+            if status == "error":
+                raise WorkerJobFailed(payload)
+            return payload
+        finally:
+            self._pending -= 1